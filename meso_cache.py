@@ -0,0 +1,104 @@
+# coding: utf-8
+
+''' Memoized mesostics for P.S.: Meso.
+
+Given an RNG seed, both engines make the same poem from the same
+inputs every time, so a shared permalink or a "make that one again"
+request need not be generated again. A ResultCache keeps finished poems
+keyed on everything that decides them: the oracle's fingerprint and
+tokenizing options, the spine, iterations, sparsity, break type and RNG
+seed. Poems made without an RNG seed are never cached. '''
+
+import sys
+import threading
+from collections import OrderedDict
+
+
+def result_size(value):
+    ''' Returns an estimate of the memory held by a cached result: a
+        string, or tuples, lists & dicts of them, line records and other
+        small values.
+
+        object -> int '''
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(result_size(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + \
+            sum(result_size(v) for v in value.values())
+    if hasattr(value, '__slots__'):
+        return sys.getsizeof(value) + \
+            sum(result_size(getattr(value, name)) for name in value.__slots__)
+    return sys.getsizeof(value)
+
+
+class ResultCache(object):
+    ''' Process-wide cache of finished poems. Least recently used
+        results are evicted once their estimated total size exceeds
+        max_bytes. '''
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        ''' Initializes an empty cache with a budget in bytes.
+            Takes (int). '''
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        ''' Returns the result stored under key, or None.
+
+            tuple -> object '''
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries[key] = value
+            return value
+
+    def put(self, key, value):
+        ''' Stores a result under key, evicting older results as needed.
+            A result larger than the whole budget is not stored.
+
+            (tuple, object) -> NoneType '''
+        size = result_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                del self._entries[key]
+                self._total -= self._sizes.pop(key)
+            self._entries[key] = value
+            self._sizes[key] = size
+            self._total += size
+            while self._total > self.max_bytes:
+                old, value = self._entries.popitem(last=False)
+                self._total -= self._sizes.pop(old)
+                self.evictions += 1
+
+    def clear(self):
+        ''' Empties the cache, leaving the counters as they are. '''
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._total = 0
+
+    def stats(self):
+        ''' Returns the cache's counters and current size.
+
+            NoneType -> dict '''
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'bytes': self._total,
+                    'max_bytes': self.max_bytes}
+
+
+POEMS = ResultCache()
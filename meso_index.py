@@ -0,0 +1,191 @@
+# coding: utf-8
+
+''' Spine-candidate index for P.S.: Meso.
+
+Reading through the oracle for the next spine word costs a pass over
+the source for every line of the mesostic, and a full pass before it
+can give up. A SpineIndex reads the oracle once per spine-letter
+transition instead, keeping the sorted positions of every word that
+could carry the spine letter, so the next candidate from any point in
+the oracle is a bisect away. '''
+
+import sys
+from array import array
+from bisect import bisect_left
+
+
+def spine_key(seed, i):
+    ''' Returns the (previous, current, next) spine letters that decide
+        whether a word can carry seed[i]. A one-letter seed has no
+        neighbours to compare against, so they are None, as is a space
+        (no word contains one).
+
+        (str, int) -> (str, str, str) '''
+    if len(seed) > 1:
+        return seed[i - 1].strip() or None, seed[i], \
+               seed[(i + 1) % len(seed)].strip() or None
+    return None, seed[i], None
+
+
+def fits_spine(word, key):
+    ''' Returns True iff the word contains the current spine letter
+        exactly one time, does not contain the previous spine letter
+        before it, and does not contain the next spine letter from
+        there on (None skips that comparison).
+
+        (str, tuple) -> bool '''
+    prev, cur, nxt = key
+    if word.count(cur) != 1:
+        return False
+    i = word.index(cur)
+    if prev is not None and word.count(prev, 0, i) > 0:
+        return False
+    if nxt is not None and word.count(nxt, i) > 0:
+        return False
+    return True
+
+
+def spine_report(index, seed):
+    ''' For each letter of a seed, counts the words in the oracle that
+        could carry it. Returns (position in seed, key, count) for every
+        letter but spaces; a count of 0 means no mesostic with that
+        spine can be completed from the oracle.
+
+        (SpineIndex, str) -> list of (int, tuple, int) '''
+    report = []
+    for i in range(len(seed)):
+        if seed[i] != ' ':
+            key = spine_key(seed, i)
+            report.append((i, key, len(index.candidates(key))))
+    return report
+
+
+def describe_key(key):
+    ''' Describes the spine letter of a key and its neighbours for
+        people, e.g. "'A' after 'C' and before 'G'".
+
+        tuple -> str '''
+    prev, cur, nxt = key
+    text = "'%s'" % cur.upper()
+    if prev and nxt:
+        text += " after '%s' and before '%s'" % (prev.upper(), nxt.upper())
+    elif prev:
+        text += " after '%s'" % prev.upper()
+    elif nxt:
+        text += " before '%s'" % nxt.upper()
+    return text
+
+
+class SpineIndex(object):
+    ''' Sorted positions of spine word candidates in an oracle, one
+        array per (previous, current, next) spine letter key. Arrays are
+        built the first time a key is asked for and kept for the life
+        of the index; nbytes keeps a running total of their size. '''
+
+    def __init__(self, words):
+        ''' Initializes an index over a sequence of oracle words (a list,
+            CompactWords or MappedWords). Words read from an index file
+            come with their postings and some candidate arrays already.
+            Takes (list of str). '''
+        self.words = words
+        self.postings = getattr(words, 'postings', None)
+        self.positions = dict(getattr(words, 'positions', {}))
+        self.nbytes = 0
+
+    def candidates(self, key):
+        ''' Returns the sorted positions of all words that can carry
+            the spine letter of key.
+
+            tuple -> array of int '''
+        try:
+            return self.positions[key]
+        except KeyError:
+            pass
+        words = self.words
+        compact = hasattr(words, 'ids')
+        if self.postings is None:
+            self.postings = self._make_postings(compact)
+        pos = array('I')
+        if compact:
+            # check each distinct word once; single-letter bits rule
+            # out most of them without looking at the word itself
+            bit = words.letter_mask(key[1])
+            single = words.single
+            for k in range(len(single)):
+                if single[k] & bit and fits_spine(words.table[k], key):
+                    pos.extend(self.postings[k])
+        else:
+            for word in self.postings:
+                if key[1] in word and fits_spine(word, key):
+                    pos.extend(self.postings[word])
+        pos = array('I', sorted(pos))
+        self.positions[key] = pos
+        self.nbytes += sys.getsizeof(pos)
+        return pos
+
+    def _make_postings(self, compact):
+        ''' Returns every position of every distinct word, in oracle
+            order: a list indexed by word id for CompactWords, else a
+            dict keyed by word.
+
+            bool -> list or dict of array of int '''
+        if compact:
+            postings = [array('I') for word in self.words.table]
+            for i, k in enumerate(self.words.ids):
+                postings[k].append(i)
+            values = postings
+        else:
+            postings = {}
+            for i, word in enumerate(self.words):
+                try:
+                    postings[word].append(i)
+                except KeyError:
+                    postings[word] = array('I', (i,))
+            values = postings.values()
+        self.nbytes += sys.getsizeof(postings) + \
+            sum(sys.getsizeof(p) for p in values)
+        return postings
+
+    def next_position(self, key, start):
+        ''' Returns the position of the first candidate for key at or
+            after start, wrapping around to the beginning of the oracle;
+            None if no word in the oracle fits.
+
+            (tuple, int) -> int '''
+        pos = self.candidates(key)
+        if not pos:
+            return None
+        k = bisect_left(pos, start)
+        return pos[k] if k < len(pos) else pos[0]
+
+
+class NextUnused(object):
+    ''' Marks slots 0 to n-1 used one by one and finds the first
+        unused slot at or after any slot in near-constant amortized
+        time, rather than stepping over the used ones: a union-find in
+        which each used slot is joined to the slot after it, with path
+        halving. Slot n is never used, so find() returns n when every
+        slot from there on is. '''
+
+    def __init__(self, n):
+        ''' Initializes a NextUnused with n unused slots.
+            Takes (int). '''
+        self.parent = array('I' if n < 1 << 32 else 'L', range(n + 1))
+
+    def find(self, i):
+        ''' Returns the first unused slot at or after slot i.
+
+            int -> int '''
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def use(self, i):
+        ''' Marks slot i used. '''
+        if self.parent[i] == i:
+            self.parent[i] = i + 1
+
+    def used(self, i):
+        return self.parent[i] != i
@@ -0,0 +1,174 @@
+# coding: utf-8
+
+''' Oracle library search for P.S.: Meso.
+
+Which of the texts in a course reader can carry a given spine? A
+Library holds any number of tokenized oracles and answers that for a
+seed without making a single mesostic. For each oracle it counts, per
+spine letter, the words that have the letter once and those that
+also have a given letter before it or after it (from the spine letter
+on, as Mesostic.is_next_spine_word reads rule 1), so the number of
+words that fit any (previous, current, next) transition is a sum of
+four counts. An inverted index from transitions to the oracles that
+can carry them, and how many candidates each has, is filled in the
+first time a transition is asked for. '''
+
+from collections import defaultdict
+
+from meso_index import spine_key
+from meso_oracle import CompactWords, Oracle, fingerprint, open_oracle
+from meso_tokens import clean_seed, tokenize
+
+
+class Transitions(object):
+    ''' Candidate counts for every spine letter transition in one
+        oracle. For each letter, once holds the number of words that
+        contain it once; before and after how many of those contain
+        another letter before it or from it on; both how many contain
+        a pair of letters, the first before it and the second after. '''
+
+    def __init__(self, words):
+        ''' Initializes the counts from a sequence of oracle words.
+            Takes (list of str). '''
+        freq = defaultdict(int)
+        if isinstance(words, CompactWords):
+            for k in words.ids:
+                freq[k] += 1
+            freq = dict((words.table[k], n) for k, n in freq.items())
+        else:
+            for word in words:
+                freq[word] += 1
+        self.words = sum(freq.values())
+        self.once = defaultdict(int)
+        self.before = defaultdict(lambda: defaultdict(int))
+        self.after = defaultdict(lambda: defaultdict(int))
+        self.both = defaultdict(lambda: defaultdict(int))
+        for word, n in freq.items():
+            for i, cur in enumerate(word):
+                if word.count(cur) != 1:
+                    continue
+                self.once[cur] += n
+                prevs, nexts = set(word[:i]), set(word[i:])
+                for prev in prevs:
+                    self.before[cur][prev] += n
+                for nxt in nexts:
+                    self.after[cur][nxt] += n
+                both = self.both[cur]
+                for prev in prevs:
+                    for nxt in nexts:
+                        both[prev, nxt] += n
+
+    def count(self, key):
+        ''' Returns the number of words in the oracle that can carry the
+            spine letter of key.
+
+            tuple -> int '''
+        prev, cur, nxt = key
+        count = self.once.get(cur, 0)
+        if not count:
+            return 0
+        if prev is not None:
+            count -= self.before[cur].get(prev, 0)
+        if nxt is not None:
+            count -= self.after[cur].get(nxt, 0)
+        if prev is not None and nxt is not None:
+            count += self.both[cur].get((prev, nxt), 0)
+        return count
+
+
+class Library(object):
+    ''' A collection of named, pre-indexed oracles that can be ranked
+        by how well they can carry a spine. With normalize, oracles and
+        spines are NFKC-normalized and casefolded (see meso_tokens). '''
+
+    def __init__(self, normalize=False):
+        ''' Initializes an empty Library.
+            Takes (bool). '''
+        self.normalize = normalize
+        self.oracles = {}
+        self.transitions = {}
+        self.index = {}
+
+    def add(self, name, text, strip_punct=True):
+        ''' Tokenizes a source text and adds it to the library under a
+            name, replacing any oracle of that name.
+
+            (str, str, bool) -> Oracle '''
+        words = CompactWords(tokenize(text, strip_punct,
+                                      normalize=self.normalize))
+        return self.add_oracle(name, Oracle(words, fingerprint(text),
+                                            (bool(strip_punct), False,
+                                             bool(self.normalize))))
+
+    def add_file(self, name, path, strip_punct=True):
+        ''' Adds a UTF-8 text file to the library under a name, read
+            through a memory map.
+
+            (str, str, bool) -> Oracle '''
+        return self.add_oracle(name, open_oracle(path, strip_punct,
+                                                 normalize=self.normalize))
+
+    def add_oracle(self, name, oracle):
+        ''' Adds an already tokenized Oracle to the library under a
+            name.
+
+            (str, Oracle) -> Oracle '''
+        self.oracles[name] = oracle
+        self.transitions[name] = Transitions(oracle.words)
+        self.index.clear()
+        return oracle
+
+    def remove(self, name):
+        ''' Takes the oracle of a name out of the library. '''
+        del self.oracles[name]
+        del self.transitions[name]
+        self.index.clear()
+
+    def candidates(self, key):
+        ''' Returns the oracles that have words to carry the spine letter
+            of key, with the number of such words in each.
+
+            tuple -> dict of {str: int} '''
+        try:
+            return self.index[key]
+        except KeyError:
+            pass
+        found = {}
+        for name, transitions in self.transitions.items():
+            count = transitions.count(key)
+            if count:
+                found[name] = count
+        self.index[key] = found
+        return found
+
+    def rank(self, seed, break_type='word'):
+        ''' Ranks every oracle in the library for a seed. Oracles that
+            can carry every spine letter come first; among them, those
+            whose scarcest spine letter has the most candidates, then
+            those with the densest candidates over all the spine letters
+            (candidates per word of the oracle, averaged). Returns, for
+            each oracle in order, (name, keys no word can carry, fewest
+            candidates for a spine letter, density).
+
+            (str, str) -> list of (str, list of tuple, int, float) '''
+        seed = clean_seed(seed, self.normalize)
+        if break_type == 'random':
+            seed = seed.replace(' ', '')
+        else:
+            seed += ' '
+        keys = []
+        for i in range(len(seed)):
+            if seed[i] != ' ' and spine_key(seed, i) not in keys:
+                keys.append(spine_key(seed, i))
+
+        ranks = []
+        for name in self.oracles:
+            counts = [self.candidates(key).get(name, 0) for key in keys]
+            blocked = [key for key, count in zip(keys, counts) if not count]
+            words = self.transitions[name].words
+            density = sum(counts) / float(len(counts) * words) \
+                      if keys and words else 0.0
+            ranks.append((name, blocked, min(counts) if counts else 0,
+                          density))
+        ranks.sort(key=lambda r: (len(r[1]), -r[2], -r[3], r[0]))
+        return ranks
@@ -0,0 +1,125 @@
+# coding: utf-8
+
+''' Line records and renderers for P.S.: Meso.
+
+The engines know where every spine letter is as they place it. A
+MesoLine keeps that: the left wing, the spine word, the offset of the
+spine letter in it, the right wing, and the number of blank lines
+(stanza breaks) that follow. The renderers lay records out with the
+spine letters in one column without looking for them again: the text
+before each spine letter is known, so the column is the longest of
+those, and each line is built once. Stanza breaks after the last line
+are dropped, as the original formatters did by stripping the poem. '''
+
+import json
+
+
+class MesoLine(object):
+    ''' One line of a mesostic. left and right are the wing words, each
+        joined by single spaces; spine[offset] is the spine letter. '''
+
+    __slots__ = ('left', 'spine', 'offset', 'right', 'stanza_break')
+
+    def __init__(self, left, spine, offset, right='', stanza_break=0):
+        ''' Initializes a MesoLine.
+            Takes (str, str, int, str, int). '''
+        self.left = left
+        self.spine = spine
+        self.offset = offset
+        self.right = right
+        self.stanza_break = stanza_break
+
+    def before(self):
+        ''' Returns the text of the line before the spine letter.
+
+            NoneType -> str '''
+        if self.left:
+            return self.left + ' ' + self.spine[:self.offset]
+        return self.spine[:self.offset]
+
+    def after(self):
+        ''' Returns the text of the line after the spine letter.
+
+            NoneType -> str '''
+        if self.right:
+            return self.spine[self.offset + 1:] + ' ' + self.right
+        return self.spine[self.offset + 1:]
+
+    def letter(self):
+        return self.spine[self.offset]
+
+    def text(self):
+        ''' Returns the line as generated, all lowercase and unpadded.
+
+            NoneType -> str '''
+        return self.before() + self.letter() + self.after()
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return 'MesoLine(%r, %r, %r, %r, %r)' % (self.left, self.spine,
+                                                 self.offset, self.right,
+                                                 self.stanza_break)
+
+
+def render(lines, mark, blank=''):
+    ''' Lays out MesoLines with their spine letters lined up in one
+        column, each letter formatted by mark. Stanza breaks are blank
+        lines, except after the last line; blank is their text, or a
+        function of the spine column that returns it. No lines at all
+        make one empty line.
+
+        (list of MesoLine, function, str) -> list of str '''
+    if not lines:
+        return ['']
+    befores = [line.before() for line in lines]
+    width = max(len(before) for before in befores)
+    if callable(blank):
+        blank = blank(width)
+    output = []
+    for line, before in zip(lines, befores):
+        output.append(' ' * (width - len(before)) + before +
+                      mark(line.letter()) + line.after())
+        output.extend([blank] * line.stanza_break)
+    del output[len(output) - lines[-1].stanza_break:]
+    return output
+
+
+def html_letter(ch):
+    return '<b>' + ch.upper() + '</b>'
+
+
+def ansi_letter(ch):
+    return '\033[1m' + ch.upper() + '\033[0m'
+
+
+def render_html(lines):
+    ''' Returns the lines for an html <pre>, the spine letters in bold.
+
+        list of MesoLine -> list of str '''
+    return render(lines, html_letter)
+
+
+def render_text(lines):
+    ''' Returns the lines as plain text, the spine letters capitalized.
+
+        list of MesoLine -> list of str '''
+    return render(lines, lambda ch: ch.upper())
+
+
+def render_ansi(lines):
+    ''' Returns the lines for a terminal, the spine letters capitalized
+        and bold.
+
+        list of MesoLine -> list of str '''
+    return render(lines, ansi_letter)
+
+
+def render_json(lines, **info):
+    ''' Returns the lines as a JSON document, one object per record,
+        along with any other information given as keywords.
+
+        (list of MesoLine, ...) -> str '''
+    info['lines'] = [line.as_dict() for line in lines]
+    return json.dumps(info, sort_keys=True)
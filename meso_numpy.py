@@ -0,0 +1,132 @@
+# coding: utf-8
+
+''' NumPy wing-word selection for P.S.: Meso.
+
+The wing loops in both engines draw a random number per word and test
+letters and lengths one word at a time. A WingPicker does the same work
+over a run of words at once: a boolean mask of the words whose letter
+bits miss both spine letters, all of the run's coin flips in a single
+draw, and a cumulative sum of word lengths to find where the 45
+character limit is reached. The rules are those of the pure Python
+loops; only the random stream differs.
+
+NumPy is optional. If it cannot be imported, available is False and the
+engines keep to their Python loops. '''
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+available = numpy is not None
+
+# words examined per vectorized step; wings rarely need more than this
+CHUNK = 64
+
+
+class WingPicker(object):
+    ''' Vectorized wing-word selection over the CompactWords of an
+        oracle, with its own random stream. '''
+
+    def __init__(self, words, seed=None):
+        ''' Initializes a WingPicker for CompactWords and a random seed.
+            Takes (CompactWords, int). '''
+        self.ids = numpy.frombuffer(words.ids, dtype=numpy.uint32) \
+                   if len(words.ids) else numpy.zeros(0, numpy.uint32)
+        self.sizes = numpy.array([len(word) + 1 for word in words.table],
+                                 dtype=numpy.int64)
+        if len(words.letters) <= 64:
+            self.masks = numpy.array(words.masks, dtype=numpy.uint64)
+            self.bits = numpy.uint64
+        else:
+            # too many letters for machine integers; AND Python ints
+            self.masks = numpy.array(words.masks, dtype=object)
+            self.bits = int
+        self.random = numpy.random.RandomState(seed)
+
+    def get_state(self):
+        ''' Returns the state of the random stream as a list of plain
+            values that can be saved as JSON.
+
+            NoneType -> list '''
+        name, keys, pos, has_gauss, cached = self.random.get_state()
+        return [name, keys.tolist(), int(pos), int(has_gauss), float(cached)]
+
+    def set_state(self, state):
+        ''' Sets the random stream to a state from get_state().
+
+            list -> NoneType '''
+        name, keys, pos, has_gauss, cached = state
+        self.random.set_state((name, numpy.array(keys, dtype=numpy.uint32),
+                               pos, has_gauss, cached))
+
+    def pick(self, length, i, end, avoid, sparsity):
+        ''' Chooses wing words as Mesostic.make_wing_words does: going
+            through the oracle from i up to end, each word without the
+            avoided letters is added with odds 1 in sparsity if it still
+            fits in length chars (counting a space after each word), and
+            the wing is done once it is full. Returns the positions of
+            the chosen words and the index after the last word considered.
+
+            (int, int, int, int, int) -> (list of int, int) '''
+        n = len(self.ids)
+        chosen = []
+        size = 0
+        while size < length and i != end:
+            stop = min(end if end > i else n, i + CHUNK)
+            ids = self.ids[i:stop]
+            ok = (self.masks[ids] & self.bits(avoid)) == 0
+            ok &= self.random.randint(sparsity, size=len(ids)) == 0
+            picked, size = self._fill(numpy.flatnonzero(ok),
+                                      self.sizes[ids], size, length)
+            chosen.extend(i + k for k in picked)
+            if size >= length:
+                return chosen, (i + picked[-1] + 1) % n
+            i = stop % n
+        return chosen, i
+
+    def pick_legacy(self, limit, place, count, avoid, odds):
+        ''' Chooses wing words as psMesoWeb.fillText does: it reads on
+            from place, at most count words, for as long as a 1 in odds
+            chance keeps coming up, and adds each word read that lacks
+            the avoided letters and fits within limit chars. Returns the
+            positions of the chosen words and the number of words read.
+
+            (int, int, int, int, int) -> (list of int, int) '''
+        n = len(self.ids)
+        # read words up to the first failed draw
+        taken = 0
+        while taken < count:
+            draws = self.random.randint(odds, size=min(CHUNK, count - taken))
+            failed = numpy.flatnonzero(draws)
+            if len(failed):
+                taken += int(failed[0])
+                break
+            taken += len(draws)
+        where = (place + numpy.arange(taken)) % max(n, 1)
+        ids = self.ids[where]
+        ok = (self.masks[ids] & self.bits(avoid)) == 0
+        # a word fits if the line so far plus the word is within limit;
+        # as a size counting its space, that is one more char of room
+        picked = self._fill(numpy.flatnonzero(ok), self.sizes[ids],
+                            0, limit + 1)[0]
+        return [int(where[k]) for k in picked], taken
+
+    def _fill(self, cand, sizes, size, length):
+        ''' Adds candidates to a wing greedily in order, skipping any
+            that no longer fit: takes the run whose cumulative size fits,
+            drops the word that overflows, and goes on with the room left.
+            Returns the indexes taken and the new size.
+
+            (array, array, int, int) -> (list of int, int) '''
+        picked = []
+        while len(cand) and size < length:
+            cand = cand[sizes[cand] <= length - size]
+            if not len(cand):
+                break
+            total = numpy.cumsum(sizes[cand])
+            fit = int(numpy.searchsorted(total, length - size, side='right'))
+            picked.extend(int(k) for k in cand[:fit])
+            size += int(total[fit - 1])
+            cand = cand[fit + 1:]
+        return picked, size
@@ -0,0 +1,419 @@
+# coding: utf-8
+
+''' Oracle preprocessing for P.S.: Meso.
+
+Both engines lowercase, split and (optionally) punctuation-strip the
+whole source text before they can look for a single spine word. People
+paste the same few oracles again and again, so the work is done once
+per distinct text and kept in a process-wide, size-bounded LRU cache
+together with anything derived from it (such as the spine index).
+
+Cached oracles are kept as CompactWords: each distinct word is stored
+once, with bitmasks of the letters in it, and the text is an array of
+word ids. Very large oracles can be read from a file instead: a
+MappedWords sequence memory-maps it and keeps only the word boundaries,
+decoding each word when it is asked for. Given a store directory, the
+cache maps prebuilt index files (see meso_store) rather than tokenizing
+the texts they were made from. '''
+
+import hashlib
+import mmap
+import os
+import re
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+from meso_index import SpineIndex
+from meso_tokens import clean_word, tokenize, word_spans
+
+
+def normal_text(text):
+    ''' Returns a source text as fingerprint() takes it: with Windows and
+        old Mac line endings made '\\n' and surrounding whitespace
+        stripped. Neither changes how the text tokenizes, but a text
+        pasted into a form comes with CRLFs and without the newline a
+        file ends with, and should be known for the same text.
+
+        str -> str '''
+    if u'\r' in text:
+        text = text.replace(u'\r\n', u'\n').replace(u'\r', u'\n')
+    return text.strip()
+
+
+def fingerprint(text):
+    ''' Returns a hex digest identifying the content of a source text,
+        once normalized by normal_text().
+
+        str -> str '''
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    return hashlib.sha1(normal_text(text).encode('utf-8')).hexdigest()
+
+
+class CompactWords(object):
+    ''' The words of an oracle with each distinct word stored once.
+        table holds the distinct words and ids the text, as an array of
+        indexes into table. letters gives each letter in the oracle a
+        bit; for each distinct word, masks has the bits of the letters
+        in it set, and single the bits of those it contains only once,
+        so asking whether a word contains a letter is an integer AND. '''
+
+    def __init__(self, words):
+        ''' Initializes CompactWords from a sequence of words.
+            Takes (list of str). '''
+        self.ids = array('I')
+        self.table = []
+        seen = {}
+        for word in words:
+            try:
+                self.ids.append(seen[word])
+            except KeyError:
+                seen[word] = len(self.table)
+                self.ids.append(len(self.table))
+                self.table.append(word)
+
+        self.letters = {}
+        self.masks = []
+        self.single = []
+        for word in self.table:
+            mask = once = 0
+            for ch in word:
+                bit = self.letters.get(ch)
+                if bit is None:
+                    bit = self.letters[ch] = 1 << len(self.letters)
+                if mask & bit:
+                    once &= ~bit
+                else:
+                    once |= bit
+                mask |= bit
+            self.masks.append(mask)
+            self.single.append(once)
+
+    def letter_mask(self, chars):
+        ''' Returns the bits of the given letters OR'd together; letters
+            that are in no word of the oracle have no bit.
+
+            str -> int '''
+        mask = 0
+        for ch in chars:
+            mask |= self.letters.get(ch, 0)
+        return mask
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        return self.table[self.ids[i]]
+
+    def __iter__(self):
+        return iter(map(self.table.__getitem__, self.ids))
+
+    def nbytes(self):
+        ''' Returns an estimate of the memory held by the word ids,
+            table and masks.
+
+            NoneType -> int '''
+        return sys.getsizeof(self.ids) + sys.getsizeof(self.table) + \
+               sum(sys.getsizeof(word) for word in self.table) + \
+               sys.getsizeof(self.masks) + sys.getsizeof(self.single) + \
+               sum(sys.getsizeof(m) for m in self.masks) + \
+               sum(sys.getsizeof(m) for m in self.single)
+
+
+class MappedWords(object):
+    ''' The words of a UTF-8 text file, as tokenize() would split them,
+        without holding them in memory. The file is memory-mapped and
+        read through lazily, a chunk at a time, as words are asked for;
+        only the byte offsets of each word are kept, in two arrays.
+        Words are found by meso_tokens.word_spans() and decoded and
+        cleaned on access. '''
+
+    CHUNK = 1 << 20
+
+    def __init__(self, path, strip_punct, drop_digits=False, normalize=False):
+        ''' Initializes a MappedWords sequence over a text file.
+            Takes (str, bool, bool, bool). '''
+        self.path = path
+        self.strip_punct = strip_punct
+        self.drop_digits = drop_digits
+        self.normalize = normalize
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.data = b''
+        code = 'I' if size < 1 << 32 else 'L'
+        self.starts = array(code)
+        self.ends = array(code)
+        self._spans = self.read_spans()
+
+    def read_spans(self):
+        ''' Reads through the file, appending the byte offsets of each
+            word to starts & ends; yields after each chunk.
+
+            NoneType -> generator of NoneType '''
+        data, pos, size = self.data, 0, len(self.data)
+        while pos < size:
+            end = min(pos + self.CHUNK, size)
+            if end < size:
+                # cut after ASCII whitespace so no word or character is split
+                cut = max(data.rfind(b'\n', pos, end), data.rfind(b' ', pos, end))
+                if cut < pos:
+                    cut = re.compile(br'\s').search(data, end)
+                    cut = cut.start() if cut else size - 1
+                end = cut + 1
+            text = data[pos:end].decode('utf-8')
+            is_ascii = len(text) == end - pos
+            byte, last = pos, 0     # byte offset of char offset last
+            for start, stop in word_spans(text, self.strip_punct,
+                                          self.drop_digits, self.normalize):
+                if is_ascii:
+                    self.starts.append(pos + start)
+                    self.ends.append(pos + stop)
+                else:
+                    byte += len(text[last:start].encode('utf-8'))
+                    self.starts.append(byte)
+                    byte += len(text[start:stop].encode('utf-8'))
+                    self.ends.append(byte)
+                    last = stop
+            pos = end
+            yield
+
+    def read_to(self, i):
+        ''' Reads through the file until word i has been found or the
+            file ends. Returns True iff there is a word i.
+
+            int -> bool '''
+        while len(self.starts) <= i and self._spans is not None:
+            try:
+                next(self._spans)
+            except StopIteration:
+                self._spans = None
+        return len(self.starts) > i
+
+    def __len__(self):
+        self.read_to(sys.maxsize)
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or not self.read_to(i):
+            raise IndexError('word index out of range')
+        return clean_word(self.data[self.starts[i]:self.ends[i]].decode('utf-8'),
+                          self.strip_punct, self.normalize)
+
+    def __iter__(self):
+        i = 0
+        while self.read_to(i):
+            yield self[i]
+            i += 1
+
+    def nbytes(self):
+        ''' Returns the size of the word offsets read so far.
+
+            NoneType -> int '''
+        return sys.getsizeof(self.starts) + sys.getsizeof(self.ends)
+
+    def fingerprint(self):
+        ''' Returns the fingerprint() of the file's text, reading it a
+            chunk at a time.
+
+            NoneType -> str '''
+        data = self.data
+        start, end = self.text_span()
+        digest = hashlib.sha1()
+        carry = b''
+        for pos in range(start, end, self.CHUNK):
+            chunk = carry + data[pos:min(pos + self.CHUNK, end)]
+            carry = b''
+            # a CR at the end of a chunk may start a CRLF
+            if chunk.endswith(b'\r') and pos + self.CHUNK < end:
+                chunk, carry = chunk[:-1], b'\r'
+            digest.update(chunk.replace(b'\r\n', b'\n')
+                          .replace(b'\r', b'\n'))
+        return digest.hexdigest()
+
+    def text_span(self):
+        ''' Returns the byte offsets of the file's text without the
+            whitespace around it, as normal_text() strips it.
+
+            NoneType -> (int, int) '''
+        data, start, end = self.data, 0, len(self.data)
+        while start < end:
+            size = self.char_size(start)
+            if not data[start:start + size].decode('utf-8').isspace():
+                break
+            start += size
+        while end > start:
+            lead = end - 1
+            # step back over UTF-8 continuation bytes to the lead byte
+            while lead > start and \
+                  0x80 <= bytearray(data[lead:lead + 1])[0] < 0xc0:
+                lead -= 1
+            if not data[lead:end].decode('utf-8').isspace():
+                break
+            end = lead
+        return start, end
+
+    def char_size(self, pos):
+        ''' Returns the length in bytes of the UTF-8 character at pos.
+
+            int -> int '''
+        lead = bytearray(self.data[pos:pos + 1])[0]
+        return 1 if lead < 0xc0 else 2 if lead < 0xe0 else 3 if lead < 0xf0 \
+            else 4
+
+    def close(self):
+        ''' Unmaps the file. '''
+        if self.data:
+            self.data.close()
+
+
+class Oracle(object):
+    ''' A tokenized source text and the structures derived from it.
+        Shared between requests, so treat the word list as read-only.
+        options holds the (strip_punct, drop_digits, normalize) it was
+        tokenized with, if known. '''
+
+    def __init__(self, words, fp=None, options=None):
+        ''' Initializes an Oracle from its list of words, the
+            fingerprint of the text they came from and the tokenizing
+            options. Options saved before normalize was one are taken
+            to be without it.
+            Takes (list of str, str, tuple). '''
+        self.words = words
+        self.fingerprint = fp
+        if options is not None:
+            options = tuple(options) + (False,) * (3 - len(options))
+        self.options = options
+        self.index = SpineIndex(words)
+        if isinstance(words, list):
+            self._nbytes = sys.getsizeof(words) + \
+                           sum(sys.getsizeof(word) for word in words)
+        elif isinstance(words, CompactWords):
+            self._nbytes = words.nbytes()
+        else:
+            self._nbytes = None
+
+    def __len__(self):
+        return len(self.words)
+
+    def nbytes(self):
+        ''' Returns an estimate of the memory held by the oracle, its
+            word list and the spine index built so far.
+
+            NoneType -> int '''
+        if self._nbytes is None:
+            return self.words.nbytes() + self.index.nbytes
+        return self._nbytes + self.index.nbytes
+
+
+class OracleCache(object):
+    ''' Process-wide cache of tokenized oracles, keyed by content hash
+        and tokenizing options. Least recently used oracles are evicted
+        once the estimated total size exceeds max_bytes. If store_dir is
+        set, a text that has an index file there is loaded from it. '''
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, store_dir=None):
+        ''' Initializes an empty cache with a budget in bytes and a
+            directory of index files.
+            Takes (int, str). '''
+        self.max_bytes = max_bytes
+        self.store_dir = store_dir
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text, strip_punct, drop_digits=False, normalize=False):
+        ''' Returns the Oracle for a source text, tokenizing it only if
+            it is not already cached.
+
+            (str, bool, bool, bool) -> Oracle '''
+        fp = fingerprint(text)
+        key = (fp, bool(strip_punct), bool(drop_digits), bool(normalize))
+        with self._lock:
+            oracle = self._entries.pop(key, None)
+            if oracle is not None:
+                self.hits += 1
+                self._entries[key] = oracle
+                self._trim()
+                return oracle
+            self.misses += 1
+        # tokenize outside the lock; a duplicate is cheaper than a stall
+        oracle = self.load(key)
+        if oracle is None:
+            oracle = Oracle(CompactWords(tokenize(text, strip_punct,
+                                                  drop_digits, normalize)),
+                            fp, key[1:])
+        with self._lock:
+            self._entries[key] = self._entries.pop(key, oracle)
+            self._trim()
+            return self._entries.get(key, oracle)
+
+    def load(self, key):
+        ''' Returns the Oracle in the store directory's index file for a
+            cache key, or None if there is none.
+
+            tuple -> Oracle '''
+        if not self.store_dir:
+            return None
+        from meso_store import index_name, load_index
+        path = os.path.join(self.store_dir, index_name(*key))
+        if not os.path.exists(path):
+            return None
+        return load_index(path)
+
+    def _trim(self):
+        ''' Evicts least recently used oracles until the cache fits its
+            budget. The newest entry is always kept. Call with the lock
+            held. '''
+        total = sum(o.nbytes() for o in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            key, oracle = self._entries.popitem(last=False)
+            total -= oracle.nbytes()
+            self.evictions += 1
+
+    def clear(self):
+        ''' Empties the cache, leaving the counters as they are. '''
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        ''' Returns the cache's counters and current size.
+
+            NoneType -> dict '''
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'bytes': sum(o.nbytes() for o in self._entries.values()),
+                    'max_bytes': self.max_bytes}
+
+
+ORACLES = OracleCache(store_dir=os.environ.get('PSMESO_INDEX_DIR'))
+
+
+def get_oracle(text, strip_punct, drop_digits=False, normalize=False):
+    ''' Returns the shared, preprocessed Oracle for a source text; its
+        words are CompactWords. With normalize, words are NFKC-normalized
+        and casefolded (see meso_tokens).
+
+        (str, bool, bool, bool) -> Oracle '''
+    return ORACLES.get(text, strip_punct, drop_digits, normalize)
+
+
+def open_oracle(path, strip_punct, drop_digits=False, normalize=False):
+    ''' Returns an Oracle over the words of a UTF-8 text file, read
+        through a memory map rather than into a string. Not cached.
+
+        (str, bool, bool, bool) -> Oracle '''
+    words = MappedWords(path, strip_punct, drop_digits, normalize)
+    return Oracle(words, words.fingerprint(),
+                  (bool(strip_punct), bool(drop_digits), bool(normalize)))
@@ -0,0 +1,80 @@
+# coding: utf-8
+
+''' Generation statistics for P.S.: Meso.
+
+When a mesostic is slow to make, a MesoStats passed to either engine
+tells why: how far each spine word search read through the oracle, how
+often it wrapped around to the beginning, how many words with the spine
+letter were passed over for breaking rule 1, how many wing words were
+taken or left, and how long each phase took. Engines given no MesoStats
+only pay for an "is None" test per line.
+
+as_dict() gives the numbers as plain data for a log line or JSON;
+server_timing() formats the phase times for a Server-Timing header. '''
+
+import logging
+
+logger = logging.getLogger('psmeso.stats')
+
+
+class MesoStats(object):
+    ''' Counters and timers for the making of one mesostic (or several,
+        if the same MesoStats is passed to each). examined holds the
+        number of words each spine word search read, one per line. '''
+
+    def __init__(self):
+        ''' Initializes a MesoStats with every count at zero. '''
+        self.examined = []
+        self.wraps = 0
+        self.rule1_rejects = 0
+        self.wing_accepted = 0
+        self.wing_rejected = 0
+        self.phases = {}
+
+    def spine_search(self, examined, wrapped, rejected):
+        ''' Records a spine word search that read examined words, wrapped
+            around the end of the oracle or not, and passed over rejected
+            words that had the spine letter but broke rule 1.
+
+            (int, bool, int) -> NoneType '''
+        self.examined.append(examined)
+        self.wraps += wrapped
+        self.rule1_rejects += rejected
+
+    def wing(self, considered, accepted):
+        ''' Records a wing that considered some words and took some.
+
+            (int, int) -> NoneType '''
+        self.wing_accepted += accepted
+        self.wing_rejected += considered - accepted
+
+    def add_time(self, phase, seconds):
+        ''' Adds to the time spent in a phase.
+
+            (str, float) -> NoneType '''
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def as_dict(self):
+        ''' Returns the statistics as a dict of plain values.
+
+            NoneType -> dict '''
+        examined = self.examined
+        return {'lines': len(examined),
+                'words_examined': sum(examined),
+                'most_examined': max(examined) if examined else 0,
+                'wraps': self.wraps,
+                'rule1_rejects': self.rule1_rejects,
+                'wing_accepted': self.wing_accepted,
+                'wing_rejected': self.wing_rejected,
+                'phases': dict(self.phases)}
+
+    def server_timing(self):
+        ''' Returns the phase times as a Server-Timing header value.
+
+            NoneType -> str '''
+        return ', '.join('%s;dur=%.3f' % (phase.strip('_'), seconds * 1000)
+                         for phase, seconds in sorted(self.phases.items()))
+
+    def log(self, log=logger, level=logging.INFO):
+        ''' Writes the statistics to a logger. '''
+        log.log(level, 'mesostic stats %r', self.as_dict())
@@ -0,0 +1,341 @@
+# coding: utf-8
+
+''' On-disk oracle index files for P.S.: Meso.
+
+Tokenizing an oracle, interning its words and working out their letter
+bits takes a new worker process a noticeable while the first time each
+text is used. An index file holds all of that, ready to use: a worker
+memory-maps it and reads the arrays in place, with no per-word parsing.
+
+File format, version 1. All integers are little-endian.
+
+    offset 0    magic b'PSMESO\\x00\\x00', version (uint32) and the
+                length of the header that follows (uint32)
+    offset 16   header: UTF-8 JSON with the fingerprint and tokenizing
+                options of the text, the number of words & distinct
+                words, the letters (in bit order), and the offset,
+                length and type of each section; padded to 8 bytes
+    sections    each 8-byte aligned:
+                text      the distinct words, UTF-8, end to end
+                starts    uint32 x (distinct + 1), where each word starts
+                          in text
+                ids       uint32 x words, the text as word ids
+                masks     uint64 x distinct, the letter bits of each word
+                single    uint64 x distinct, the bits of the letters it
+                          has only once
+                postings  uint32 x words, the positions of each word in
+                          the text, grouped by word id
+                pstarts   uint32 x (distinct + 1), where each word's
+                          positions start in postings
+                keys      uint32 arrays of spine candidate positions for
+                          the (previous, current, next) transitions the
+                          file was built with, listed in the header
+
+With more than 64 distinct letters the masks don't fit machine words;
+then each is stored in mask_bytes bytes, little-endian.
+
+The fingerprint is meso_oracle.fingerprint() of the text, which is
+taken after normal_text() has made every line ending '\\n' and stripped
+the whitespace around the text, so an index built from a file is found
+for the same text pasted into the web form.
+
+The header's options are [strip_punct, drop_digits, normalize]; files
+that list only the first two were not normalized.
+
+OracleCache looks for index files named by index_name() in its store
+directory before it tokenizes a text, so a deploy can ship prebuilt
+indexes for the course texts. tools/build_index.py writes them. '''
+
+import binascii
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from meso_index import SpineIndex
+from meso_oracle import CompactWords, Oracle, fingerprint, open_oracle
+from meso_tokens import tokenize
+
+MAGIC = b'PSMESO\x00\x00'
+VERSION = 1
+HEAD = struct.Struct('<8sII')
+LITTLE = sys.byteorder == 'little'
+# array type of the uint64 sections; the header calls it 'Q'
+WORD64 = 'L' if array('L').itemsize == 8 else 'Q'
+
+
+def index_name(fp, strip_punct, drop_digits, normalize=False):
+    ''' Returns the file name of the index for a text's fingerprint and
+        tokenizing options; a normalized index has an n after the flags.
+
+        (str, bool, bool, bool) -> str '''
+    return '%s-%d%d%s.psmi' % (fp, bool(strip_punct), bool(drop_digits),
+                               'n' if normalize else '')
+
+
+def _typed(values, code):
+    ''' Returns values as little-endian bytes of array type code. '''
+    values = array(code, values)
+    if not LITTLE:
+        values.byteswap()
+    return values.tobytes() if hasattr(values, 'tobytes') \
+        else values.tostring()
+
+
+def _view(data, offset, count, code):
+    ''' Returns a sequence of count items of array type code read from
+        data at offset: a view of the mapped bytes where the platform
+        allows it, else a copy. '''
+    end = offset + count * array(code).itemsize
+    if LITTLE and hasattr(memoryview, 'cast'):
+        return memoryview(data)[offset:end].cast(code)
+    values = array(code)
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data[offset:end])
+    else:
+        values.fromstring(data[offset:end])
+    if not LITTLE:
+        values.byteswap()
+    return values
+
+
+class WideMasks(object):
+    ''' Letter bitmasks of more than 64 bits, width bytes each, read
+        from a buffer as Python ints. '''
+
+    def __init__(self, data, offset, count, width):
+        self.data = data
+        self.offset = offset
+        self.count = count
+        self.width = width
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, k):
+        if not 0 <= k < self.count:
+            raise IndexError('mask index out of range')
+        start = self.offset + k * self.width
+        raw = bytearray(self.data[start:start + self.width])
+        raw.reverse()
+        return int(binascii.hexlify(raw), 16)
+
+    def __iter__(self):
+        return (self[k] for k in range(self.count))
+
+
+class WordTable(object):
+    ''' The distinct words of an index file, decoded when asked for. '''
+
+    def __init__(self, data, text, starts):
+        self.data = data
+        self.text = text
+        self.starts = starts
+        self.words = {}
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def __getitem__(self, k):
+        try:
+            return self.words[k]
+        except KeyError:
+            pass
+        if not 0 <= k < len(self.starts) - 1:
+            raise IndexError('word index out of range')
+        word = bytes(self.data[self.text + self.starts[k]:
+                               self.text + self.starts[k + 1]]).decode('utf-8')
+        self.words[k] = word
+        return word
+
+    def __iter__(self):
+        return (self[k] for k in range(len(self)))
+
+
+class Postings(object):
+    ''' The positions of each distinct word of an index file, by word
+        id, as views of the file. '''
+
+    def __init__(self, positions, starts):
+        self.positions = positions
+        self.starts = starts
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def __getitem__(self, k):
+        return self.positions[self.starts[k]:self.starts[k + 1]]
+
+
+class StoredWords(CompactWords):
+    ''' CompactWords read from an index file: the word ids, letter bits
+        and spine candidate positions are views of the memory-mapped
+        file and distinct words are decoded on first use. '''
+
+    def __init__(self, path):
+        ''' Initializes StoredWords from an index file. Raises
+            ValueError if the file is not an index of a known version.
+            Takes (str). '''
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, size = HEAD.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not an oracle index file' % path)
+        if version != VERSION:
+            raise ValueError('%s has index format version %d, not %d'
+                             % (path, version, VERSION))
+        self.header = head = json.loads(
+            bytes(self.data[HEAD.size:HEAD.size + size]).decode('utf-8'))
+        sections = head['sections']
+
+        def section(name):
+            offset, count, code = sections[name]
+            return _view(self.data, offset, count,
+                         WORD64 if code == 'Q' else code)
+
+        self.ids = section('ids')
+        self.table = WordTable(self.data, sections['text'][0],
+                               section('starts'))
+        self.letters = dict((ch, 1 << i) for i, ch in enumerate(head['letters']))
+        if head['mask_bytes']:
+            self.masks = WideMasks(self.data, sections['masks'][0],
+                                   head['distinct'], head['mask_bytes'])
+            self.single = WideMasks(self.data, sections['single'][0],
+                                    head['distinct'], head['mask_bytes'])
+        else:
+            self.masks = section('masks')
+            self.single = section('single')
+        self.postings = Postings(section('postings'), section('pstarts'))
+        self.positions = {}
+        for key, offset, count in head['keys']:
+            self.positions[tuple(key)] = _view(self.data, offset, count, 'I')
+
+    def nbytes(self):
+        ''' Returns the memory held outside the mapped file, by the
+            words decoded so far.
+
+            NoneType -> int '''
+        return sys.getsizeof(self.table.words) + \
+            sum(sys.getsizeof(w) for w in self.table.words.values())
+
+
+def write_index(path, oracle, keys=()):
+    ''' Writes an index file for an Oracle of CompactWords, with the
+        spine candidate positions of the given transitions.
+
+        (str, Oracle, list of tuple) -> NoneType '''
+    words = oracle.words
+    letters = sorted(words.letters, key=words.letters.get)
+    wide = len(letters) > 64
+    width = (len(letters) + 7) // 8 if wide else 0
+
+    def masks(values):
+        if not wide:
+            return _typed(values, WORD64)
+        return b''.join(bytes(bytearray((m >> (8 * b)) & 0xff
+                                        for b in range(width)))
+                        for m in values)
+
+    encoded = [word.encode('utf-8') for word in words.table]
+    starts = [0]
+    for word in encoded:
+        starts.append(starts[-1] + len(word))
+    counts = [0] * len(encoded)
+    for k in words.ids:
+        counts[k] += 1
+    pstarts = [0]
+    for count in counts:
+        pstarts.append(pstarts[-1] + count)
+    postings = array('I', [0]) * len(words.ids)
+    fill = pstarts[:-1]
+    for i, k in enumerate(words.ids):
+        postings[fill[k]] = i
+        fill[k] += 1
+
+    index = oracle.index if oracle.index.words is words else SpineIndex(words)
+    blobs = [('text', b''.join(encoded), starts[-1], 'B'),
+             ('starts', _typed(starts, 'I'), len(starts), 'I'),
+             ('ids', _typed(words.ids, 'I'), len(words.ids), 'I'),
+             ('masks', masks(words.masks), len(words.masks), 'Q'),
+             ('single', masks(words.single), len(words.single), 'Q'),
+             ('postings', _typed(postings, 'I'), len(postings), 'I'),
+             ('pstarts', _typed(pstarts, 'I'), len(pstarts), 'I')]
+    for key in keys:
+        pos = index.candidates(key)
+        blobs.append((key, _typed(pos, 'I'), len(pos), 'I'))
+
+    options = oracle.options or (False, False, False)
+    head = {'fingerprint': oracle.fingerprint,
+            'options': [bool(option) for option in options],
+            'words': len(words.ids),
+            'distinct': len(encoded),
+            'letters': letters,
+            'mask_bytes': width}
+
+    # the offsets go in the header, so lay it out until its size settles
+    size = 0
+    while True:
+        offset = HEAD.size + size
+        offset += -offset % 8
+        sections, keyed = {}, []
+        for name, blob, count, code in blobs:
+            if isinstance(name, tuple):
+                keyed.append([list(name), offset, count])
+            else:
+                sections[name] = [offset, count, code]
+            offset += len(blob)
+            offset += -offset % 8
+        head['sections'], head['keys'] = sections, keyed
+        text = json.dumps(head, sort_keys=True).encode('utf-8')
+        if len(text) == size:
+            break
+        size = len(text)
+
+    with open(path, 'wb') as f:
+        f.write(HEAD.pack(MAGIC, VERSION, size) + text)
+        for name, blob, count, code in blobs:
+            f.write(b'\0' * (-f.tell() % 8))
+            f.write(blob)
+
+
+def build_index(path, text, strip_punct, drop_digits=False, keys=(),
+                normalize=False):
+    ''' Tokenizes a source text and writes its index file.
+
+        (str, str, bool, bool, list of tuple, bool) -> NoneType '''
+    oracle = Oracle(CompactWords(tokenize(text, strip_punct, drop_digits,
+                                          normalize)),
+                    fingerprint(text),
+                    (bool(strip_punct), bool(drop_digits), bool(normalize)))
+    write_index(path, oracle, keys)
+
+
+def index_file(source, out_dir, strip_punct, drop_digits=False, keys=(),
+               normalize=False):
+    ''' Tokenizes a UTF-8 text file, read through a memory map rather
+        than into a string, and writes its index file to a directory
+        under its index_name(). Returns the index file's path.
+
+        (str, str, bool, bool, list of tuple, bool) -> str '''
+    mapped = open_oracle(source, strip_punct, drop_digits, normalize)
+    try:
+        path = os.path.join(out_dir, index_name(mapped.fingerprint,
+                                                *mapped.options))
+        write_index(path, Oracle(CompactWords(mapped.words),
+                                 mapped.fingerprint, mapped.options), keys)
+    finally:
+        mapped.words.close()
+    return path
+
+
+def load_index(path):
+    ''' Returns the Oracle in an index file, memory-mapped. Pass it to
+        Mesostic in place of the text.
+
+        str -> Oracle '''
+    words = StoredWords(path)
+    return Oracle(words, words.header['fingerprint'],
+                  tuple(words.header['options']))
@@ -0,0 +1,127 @@
+# coding: utf-8
+
+''' Tokenizing for P.S.: Meso.
+
+Both engines read oracles and spines the same way: lowercase the text,
+split it on whitespace, strip punctuation from either end of each word
+and drop the words left empty, and, for the web engine, numbers (such
+as the section numbers in Song of Myself). Spines lose all their
+punctuation, in one pass through a translate table.
+
+Splitting and stripping with str methods beats a compiled regex here,
+since each runs in C over the whole text or word. iter_tokens() gives
+the same words from a file or stream read a chunk at a time, and
+word_spans() finds them in place, for readers such as
+meso_oracle.MappedWords that keep offsets into a file rather than the
+words themselves.
+
+With normalize, text is NFKC-normalized and casefolded rather than just
+lowercased, so compatibility characters (ligatures, full-width letters)
+and case variants such as 'ß' and 'ss' tokenize alike. Neither engine
+asks for it, so their poems stay as they were. '''
+
+import codecs
+import re
+import unicodedata
+
+PUNCT = u'.,;:?/|\\\'\"-!%^&*()[]{}<>_=+~`@#$%¡¿«»–—‘’“”'
+SEED_TABLE = dict.fromkeys(map(ord, PUNCT))
+WORD = re.compile(r'\S+', re.UNICODE)
+
+
+def fold(text, normalize=False):
+    ''' Returns text lowercased, or NFKC-normalized and casefolded if
+        normalize is set (where casefold() is available).
+
+        (str, bool) -> str '''
+    if not normalize:
+        return text.lower()
+    text = unicodedata.normalize('NFKC', text)
+    return text.casefold() if hasattr(text, 'casefold') else text.lower()
+
+
+def tokenize(text, strip_punct, drop_digits=False, normalize=False):
+    ''' Splits source text into a list of lowercase words, stripping
+        punctuation from either end of each word if requested. Empty
+        words are dropped, as are numbers if drop_digits is set (for
+        section numbers like those in Song of Myself).
+
+        (str, bool, bool, bool) -> list of str '''
+    words = fold(text, normalize).split()
+    if strip_punct:
+        words = [word.strip(PUNCT) for word in words]
+    if drop_digits:
+        return [word for word in words if word and not word.isdigit()]
+    return list(filter(None, words))
+
+
+def iter_tokens(stream, strip_punct, drop_digits=False, normalize=False,
+                size=1 << 16):
+    ''' Generates the words tokenize() would make of everything read from
+        a stream, reading size characters at a time. A binary stream is
+        decoded as UTF-8.
+
+        (file, bool, bool, bool, int) -> generator of str '''
+    decode = None
+    tail = u''
+    while True:
+        chunk = data = stream.read(size)
+        if not isinstance(data, type(u'')):
+            if decode is None:
+                decode = codecs.getincrementaldecoder('utf-8')().decode
+            chunk = decode(data, not data)
+        if not data:
+            break
+        if not chunk:
+            continue
+        text = tail + chunk
+        # hold back the last word, which may go on in the next chunk
+        if text[-1].isspace():
+            tail = u''
+        else:
+            parts = text.rsplit(None, 1)
+            text, tail = parts if len(parts) == 2 else (u'', text)
+        for word in tokenize(text, strip_punct, drop_digits, normalize):
+            yield word
+    for word in tokenize(tail, strip_punct, drop_digits, normalize):
+        yield word
+
+
+def clean_word(word, strip_punct, normalize=False):
+    ''' Returns a word, with no whitespace in it, as tokenize() would
+        make it: lowercased, or normalized, and stripped of punctuation
+        at either end if requested.
+
+        (str, bool, bool) -> str '''
+    word = fold(word, normalize)
+    return word.strip(PUNCT) if strip_punct else word
+
+
+def word_spans(text, strip_punct, drop_digits=False, normalize=False):
+    ''' Generates the (start, end) offsets in text of the words tokenize()
+        would make of it, less any punctuation stripped from their ends.
+        clean_word() makes each word of its span. With normalize, a word
+        that NFKC-normalizes to more than one stays one word.
+
+        (str, bool, bool, bool) -> generator of (int, int) '''
+    for m in WORD.finditer(text):
+        word = m.group()
+        token = clean_word(word, strip_punct, normalize)
+        if not token or (drop_digits and token.isdigit()):
+            continue
+        start, end = m.span()
+        if strip_punct:
+            start += len(word) - len(word.lstrip(PUNCT))
+            end -= len(word) - len(word.rstrip(PUNCT))
+        yield start, end
+
+
+def clean_seed(seed, normalize=False):
+    ''' Returns a spine text lowercased and stripped of surrounding
+        whitespace and all punctuation.
+
+        (str, bool) -> str '''
+    if not isinstance(seed, type(u'')):
+        # a Python 2 str: translate() takes no dict table for it
+        seed = seed.decode('utf-8')
+    return fold(seed.strip(), normalize).translate(SEED_TABLE)
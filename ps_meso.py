@@ -17,112 +17,392 @@ the criteria), it will print a message and the incomplete mesostic.
 
 A true mesostic would use a word no more times than it occurs in the
 oracle; this program may, however, when it has to loop back to the
-beginning to find suitable words. '''
+beginning to find suitable words - unless it is asked to be strict, in
+which case it stops when the oracle runs out of unused words. '''
 
-from random import randrange
+import argparse
+import io
+import json
+import multiprocessing
+import random
+import sys
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from timeit import default_timer
+
+import meso_numpy
+from meso_cache import POEMS
+from meso_index import NextUnused, describe_key, fits_spine, spine_key, \
+                       spine_report
+from meso_lines import MesoLine, html_letter, render_html, render_json
+from meso_oracle import ORACLES, CompactWords, Oracle, get_oracle, \
+    open_oracle
+from meso_tokens import clean_seed
 
 
 class Mesostic(object):
     ''' An instance of a mesostic poem. The poem variable holds the
-        mesostic itself; others contain information about the poem's
-        construction - source and spine text, number of iterations of
-        the spine, where to place line breaks (randomly or between
-        words), how sparse to make wing text, and whether creation of
-        the mesostic succeeded or failed with these parameters. '''
-
-    def __init__(self, text, seed, iters, sparsity, strip_punct, break_type):
-        ''' Initializes a Mesostic object. 
-            Takes (str, str, int, int, bool, str). '''
+        mesostic itself and lines a MesoLine record of each line; others
+        contain information about the poem's construction - source and
+        spine text, number of iterations of the spine, where to place
+        line breaks (randomly or between words), how sparse to make wing
+        text, and whether creation of the mesostic succeeded or failed
+        with these parameters. '''
+
+    def __init__(self, text, seed, iters, sparsity, strip_punct, break_type,
+                 stream=False, vectorize=False, rng=None, stats=None,
+                 strict=False, normalize=False):
+        ''' Initializes a Mesostic object. The text may also be an
+            already tokenized Oracle, such as one loaded from an index
+            file by meso_store.load_index, in which case its own options
+            take the place of strip_punct and normalize. In stream mode
+            the poem is not generated up front; iterate over
+            iter_records() or iter_lines() instead. With vectorize, wing
+            words are chosen by the NumPy engine when NumPy is installed.
+            Given an rng seed, the same inputs always make the same poem,
+            and it is taken from the result cache if it has been made.
+            Given a MesoStats, records how the poem was made in it.
+            A strict mesostic uses each word of the oracle at most once,
+            as a spine or wing word, and fails when there is no unused
+            word left for a spine letter; exhausted then says where.
+            With normalize, the oracle and spine are NFKC-normalized and
+            casefolded rather than lowercased (see meso_tokens).
+            Takes (str, str, int, int, bool, str, bool, bool, int,
+            MesoStats, bool, bool). '''
+        start = default_timer()
+        self.stats = stats
         self.poem = ""
+        self.lines = []
         self.fail = False
+        self.rng = rng
+        self.random = random.Random(rng)
         self.iters = iters
         self.sparsity = sparsity
         self.random_br = break_type == 'random'
-        PUNCT = u'.,;:?/|\\\'\"-!%^&*()[]{}<>_=+~`@#$%¡¿«»–—‘’“”'
+        # where generation stands: whole iterations done, the next spine
+        # letter, and the index of the last word considered
+        self.done = 0
+        self.line = 0
+        self.cursor = 0
+        self.breaks = 0         # stanza breaks after the last line so far
+        self.strict = strict
+        self.exhausted = None
 
-        # self.seed = strip whitespace around seed, strip all punctuation
-        self.seed = "".join(filter(lambda x: x not in PUNCT, seed.strip().lower()))
+        # source text - split into list, strip punct if requested;
+        # shared with other requests for the same text
+        if isinstance(text, Oracle):
+            self.oracle = text
+        else:
+            self.oracle = get_oracle(text, strip_punct, normalize=normalize)
+        if self.oracle.options:
+            normalize = self.oracle.options[2]
+
+        # self.seed = strip whitespace around seed, strip all punctuation,
+        # folded as the oracle's words were
+        self.seed = clean_seed(seed, normalize)
         if self.random_br:
             self.seed = self.seed.replace(' ', '')
         else:
             self.seed += ' '
 
-        # source text - split into list, strip punct if requested
-        if strip_punct:
-            text = [word.strip(PUNCT) for word in text.lower().split()]
-        else:
-            text = text.lower().split()
-        self.source = filter(None, text)
+        self.source = self.oracle.words
+        self.index = self.oracle.index
+
+        # how many words can carry each spine letter; the poem can only
+        # get as far as the first letter that none can
+        self.report = spine_report(self.index, self.seed)
+        blocked = [(i, key) for i, key, count in self.report if not count]
+        self.blocked = [key for i, key in blocked]
+        self.stop = blocked[0][0] if blocked else None
+
+        # in strict mode, the oracle positions used so far, and for each
+        # spine letter key, the candidates in the index known to be used
+        if strict:
+            self.unused = NextUnused(len(self.source))
+            self.consumed = array('I')
+            self.skips = {}
+
+        # the NumPy engine needs the letter bits of CompactWords, and
+        # does not skip used words
+        self.wings = None
+        if vectorize and not strict and meso_numpy.available and \
+           isinstance(self.source, CompactWords):
+            self.wings = meso_numpy.WingPicker(self.source,
+                                               self.random.randrange(1 << 32))
+        if stats is not None:
+            stats.add_time('__init__', default_timer() - start)
+
+        if not stream:
+            key = self.cache_key()
+            cached = POEMS.get(key) if key else None
+            if cached:
+                self.set_lines(list(cached[0]))
+                self.fail = cached[1]
+                self.restore(cached[2])
+            else:
+                self.make_poem()
+                if key:
+                    POEMS.put(key, (tuple(self.lines), self.fail,
+                                    self.continuation()))
+
+    @classmethod
+    def resume(cls, text, state, stats=None):
+        ''' Returns a Mesostic with no lines yet that carries on where
+            the one that gave its continuation() state stopped; extend()
+            it to make more. The text must be the same source text.
+            Raises ValueError if it is not.
+
+            (str, dict, MesoStats) -> Mesostic '''
+        # tokenize the text as the oracle was, or the word positions in
+        # the state point at other words
+        strip_punct, drop_digits, normalize = \
+            (tuple(state['options'] or ()) + (False,) * 3)[:3]
+        oracle = get_oracle(text, strip_punct, drop_digits, normalize)
+        poem = cls(oracle, state['seed'], state['iters'], state['sparsity'],
+                   strip_punct, state['break_type'], stream=True,
+                   vectorize=state['wings'] is not None, stats=stats,
+                   strict=state['used'] is not None)
+        if poem.oracle.fingerprint != state['fingerprint']:
+            raise ValueError('not the source text the mesostic was made from')
+        poem.restore(state)
+        return poem
+
+    def continuation(self):
+        ''' Returns the state needed to carry on with the poem later, as
+            a dict of plain values that can be saved as JSON: the source
+            text's fingerprint, the spine and options, where generation
+            stands in the spine and the oracle, the stanza breaks due
+            before the next line, the words used (if strict), where a
+            strict poem ran out of words and the state of the random
+            number generators.
+
+            NoneType -> dict '''
+        version, internal, gauss = self.random.getstate()
+        return {'fingerprint': self.oracle.fingerprint,
+                'options': self.oracle.options and list(self.oracle.options),
+                'seed': self.seed,
+                'sparsity': self.sparsity,
+                'break_type': 'random' if self.random_br else 'word',
+                'iters': self.done,
+                'line': self.line,
+                'word': self.cursor,
+                'breaks': self.breaks,
+                'rng': [version, list(internal), gauss],
+                'used': list(self.consumed) if self.strict else None,
+                'exhausted': self.exhausted and list(self.exhausted),
+                'wings': self.wings.get_state() if self.wings else None}
+
+    def restore(self, state):
+        ''' Sets where generation stands and the random number generators
+            from a continuation() state.
+
+            dict -> NoneType '''
+        self.done, self.line = state['iters'], state['line']
+        self.cursor, self.breaks = state['word'], state['breaks']
+        if state.get('exhausted'):
+            self.exhausted = tuple(state['exhausted'])
+        version, internal, gauss = state['rng']
+        self.random.setstate((version, tuple(internal), gauss))
+        if self.wings and state['wings']:
+            self.wings.set_state(state['wings'])
+        if self.strict:
+            for i in state['used']:
+                self.use(i)
+
+    def extend(self, n):
+        ''' Adds n more iterations of the spine to the poem, carrying on
+            from where it stopped, as if it had been asked for them from
+            the start. Returns the records of the new lines.
+
+            int -> list of MesoLine '''
+        if self.fail:
+            return []
+        self.iters = self.done + n
+        start = len(self.lines)
+        self.lines.extend(self.iter_records())
+        self.poem += ''.join(ln + '\n'
+                             for ln in self.lines_text(self.lines[start:]))
+        return self.lines[start:]
+
+    def cache_key(self):
+        ''' Returns the result cache key for the poem: None if it was not
+            given an rng seed or the oracle's text is unknown.
 
-        self.make_poem()
+            NoneType -> tuple '''
+        if self.rng is None or self.oracle.fingerprint is None:
+            return None
+        return ('ps_meso', self.oracle.fingerprint, self.oracle.options,
+                self.seed, self.iters, self.sparsity, self.random_br,
+                self.wings is not None, self.strict, self.rng)
 
     def make_poem(self):
         ''' Generates poem text from the Mesostic's instance variables.
             If it cannot find suitable spine words for all spine letters,
             generates as much as possible & sets self.fail True. '''
-        word = 0
-        for i in range(self.iters):
-            for line in range(len(self.seed)):
-                word = self.make_line(line, word)
-                if self.fail: break
-                self.poem += '\n'
+        start = default_timer()
+        self.set_lines(list(self.iter_records()))
+        if self.stats is not None:
+            self.stats.add_time('make_poem', default_timer() - start)
+
+    def set_lines(self, lines):
+        ''' Keeps the poem's line records in self.lines and its text in
+            self.poem.
+
+            list of MesoLine -> NoneType '''
+        self.lines = lines
+        self.poem = ''.join(ln + '\n' for ln in self.lines_text(lines))
+
+    def iter_records(self):
+        ''' Generates the poem one line record at a time, yielding each
+            line as soon as it and the stanza breaks after it are known,
+            from where generation stands until self.iters iterations are
+            done. If it cannot find suitable spine words for all spine
+            letters, stops there & sets self.fail True.
+
+            NoneType -> generator of MesoLine '''
+        # a space in the spine is a stanza break after the line before it
+        spaces = [0] * len(self.seed)
+        for line in range(len(self.seed) - 2, -1, -1):
+            if self.seed[line + 1] == ' ':
+                spaces[line] = spaces[line + 1] + 1
+        while self.done < self.iters:
+            while self.line < len(self.seed):
+                line = self.line
+                if self.seed[line] == ' ':
+                    self.line += 1
+                    continue
+                # fail at once where the spine report says no word fits
+                if line == self.stop:
+                    self.fail = True
+                    return
+                record, word = self.make_line(line, self.cursor)
+                if self.fail: return
+                record.stanza_break = spaces[line]
                 # 7 is a magic #; didn't want stanza breaks tied to sparsity
-                if self.random_br and not randrange(7): self.poem += '\n'
-            if self.fail: break
+                if self.random_br and not self.random.randrange(7):
+                    record.stanza_break = 1
+                self.cursor, self.line = word, line + 1
+                self.breaks = record.stanza_break
+                yield record
+            self.done, self.line = self.done + 1, 0
+
+    def iter_lines(self):
+        ''' Generates the poem one line at a time, yielding each line as
+            soon as it is finished; a stanza break is yielded as an empty
+            line. If it cannot find suitable spine words for all spine
+            letters, stops there & sets self.fail True.
+
+            NoneType -> generator of str '''
+        return self.lines_text(self.iter_records())
+
+    def lines_text(self, records):
+        ''' Generates the text of each line record, followed by its
+            stanza breaks: a blank line for a space in the spine or an
+            empty one for a random break.
+
+            iterable of MesoLine -> generator of str '''
+        blank = '' if self.random_br else ' '
+        for record in records:
+            yield record.text()
+            for b in range(record.stanza_break): yield blank
 
     def make_line(self, line, word):
-        ''' Creates and appends the next line to the poem.
-            Returns the index of the last word considered.
+        ''' Creates the next line of the poem. Returns its record and
+            the index of the last word considered.
             
-            (int, int) -> int '''
-        # if spine letter is space, line is blank - add space and return
-        if self.seed[line] == ' ':
-            self.poem += ' '
-            return word
-        
+            (int, int) -> (MesoLine, int) '''
+        if self.strict:
+            find, wings = self.find_next_unused_spine_word, \
+                          self.make_unused_wing_words
+        else:
+            find, wings = self.find_next_spine_word, self.make_wing_words
+
         # spine word index, index of spine letter inside spine word
-        spine_word, self.fail = self.find_next_spine_word(word, line)
-        if self.fail: return spine_word
-        i = self.source[spine_word].index(self.seed[line])
+        spine_word, self.fail = find(word, line)
+        if self.stats is not None:
+            self.record_search(word, None if self.fail else spine_word, line)
+        if self.fail:
+            if self.strict:
+                self.exhausted = (self.done, line)
+            return None, spine_word
+        spine = self.source[spine_word]
+        i = spine.index(self.seed[line])
+        if self.strict: self.use(spine_word)
         
         # left hand wing words
-        limit = 45 - len(self.source[spine_word][:i])
-        wing = self.make_wing_words(limit,
-                                    word,
-                                    spine_word,
-                                    self.seed[line],
-                                    self.seed[line - 1])[0]
-        if wing: self.poem += wing + ' '
-
-        # add spine word
-        self.poem += self.source[spine_word]
-        
+        left = wings(45 - i,
+                     word,
+                     spine_word,
+                     self.seed[line],
+                     self.seed[line - 1])[0]
+
         # find next spine word to know where to stop right wing
         # note: end of subset of words could come before beginning
-        word = self.find_next_spine_word((spine_word + 1) % len(self.source),
-                                         line)[0]
+        word, last = find((spine_word + 1) % len(self.source), line)
+        # a strict poem may have used the rest; then it can go all round
+        if last: word = spine_word
             
         # right hand wing words
-        limit = 45 - len(self.source[spine_word][i+1:])
-        wing, word = self.make_wing_words(limit,
-                                          (spine_word + 1) % len(self.source),
-                                          word,
-                                          self.seed[line],
-                                          self.seed[(line+1) % len(self.seed)])
-        if wing: self.poem += ' ' + wing
+        right, word = wings(45 - len(spine[i+1:]),
+                                           (spine_word + 1) % len(self.source),
+                                           word,
+                                           self.seed[line],
+                                           self.seed[(line+1) % len(self.seed)])
 
-        return word
+        return MesoLine(left, spine, i, right), word
 
     def find_next_spine_word(self, start, s):
-        ''' Finds index of next spine word. Returns index and boolean
-            (True if a spine word could not be found, False otherwise).
+        ''' Finds index of next spine word, looking it up in the spine
+            index rather than reading through the oracle. Returns index
+            and boolean (True if a spine word could not be found, False
+            otherwise).
 
             (int, int) -> (int, bool) '''
-        i = start
-        while not self.is_next_spine_word(self.source[i], s):
-            i = (i + 1) % len(self.source)
-            if i == start: return i, bool("failed")
-        return i, bool()        
+        i = self.index.next_position(spine_key(self.seed, s), start)
+        if i is None: return start, bool("failed")
+        return i, bool()
+
+    def find_next_unused_spine_word(self, start, s):
+        ''' Finds index of next spine word, as find_next_spine_word
+            does, among the words not used yet. Candidates found to be
+            used are skipped for good.
+
+            (int, int) -> (int, bool) '''
+        key = spine_key(self.seed, s)
+        pos = self.index.candidates(key)
+        skip = self.skips.get(key)
+        if skip is None:
+            skip = self.skips[key] = NextUnused(len(pos))
+        k = skip.find(bisect_left(pos, start))
+        for wrap in (False, True):
+            while k < len(pos) and self.unused.used(pos[k]):
+                skip.use(k)
+                k = skip.find(k)
+            if k < len(pos): return pos[k], bool()
+            k = skip.find(0)
+        return start, bool("failed")
+
+    def use(self, i):
+        ''' Marks word i of the oracle used, in a strict mesostic. '''
+        if not self.unused.used(i):
+            self.unused.use(i)
+            self.consumed.append(i)
+
+    def record_search(self, start, end, s):
+        ''' Records in self.stats a spine word search from start that
+            found its word at end (None if it found none): the words it
+            covered, whether it wrapped around, and the words passed over
+            that have spine letter s once but break rule 1.
+
+            (int, int, int) -> NoneType '''
+        n, ch = len(self.source), self.seed[s]
+        examined = n if end is None else (end - start) % n + 1
+        passed = examined if end is None else examined - 1
+        rejected = sum(1 for k in range(start, start + passed)
+                       if self.source[k % n].count(ch) == 1)
+        self.stats.spine_search(examined, end is not None and end < start,
+                                rejected)
 
     def is_next_spine_word(self, word, i):
         ''' Checks whether the word meets requirements for the next
@@ -132,15 +412,7 @@ class Mesostic(object):
             subsequent spine letter after next spine letter.
             
             (str, int) -> bool '''
-        if word.count(self.seed[i]) != 1:
-            return False
-        elif len(self.seed) > 1:    # don't compare spine letter to itself
-            if word.count(self.seed[i-1], 0, word.index(self.seed[i])) > 0:
-                return False
-            elif word.count(self.seed[(i+1) % len(self.seed)],
-                                          word.index(self.seed[i])) > 0:
-                return False
-        return True
+        return fits_spine(word, spine_key(self.seed, i))
 
     def make_wing_words(self, length, i, end, char1, char2):
         ''' Generates wing text for half of a line of the mesostic.
@@ -150,53 +422,289 @@ class Mesostic(object):
             Takes max length in chars, start and end indices of usable
             subset of source, and the book-end spine letters; returns
             string of wing words and index of last word considered. '''
-        wing = ''
-        while len(wing) < length and i != end:
-            word = self.source[i]
-            if word.count(char1) == 0 and \
-               word.count(char2) == 0 and \
-               len(wing + word + ' ') <= length and \
-               not randrange(self.sparsity):
-                wing += word + ' '
-            i = (i + 1) % len(self.source)
-        return wing.strip(), i
-
-    def format_html(self):
+        if self.wings is not None:
+            first = i
+            picked, i = self.wings.pick(length, i, end,
+                                        self.source.letter_mask(char1 + char2),
+                                        self.sparsity)
+            if self.stats is not None:
+                self.stats.wing((i - first) % len(self.source), len(picked))
+            return ' '.join(self.source[k] for k in picked), i
+
+        source, n = self.source, len(self.source)
+        compact = isinstance(source, CompactWords)
+        if compact:
+            # one AND against the word's letter bits tests both letters
+            ids, table, masks = source.ids, source.table, source.masks
+            avoid = source.letter_mask(char1 + char2)
+        wing = []
+        size = 0                # length of the wing words plus a space each
+        first = i
+        while size < length and i != end:
+            if compact:
+                word = table[ids[i]]
+                clear = not masks[ids[i]] & avoid
+            else:
+                word = source[i]
+                clear = word.count(char1) == 0 and word.count(char2) == 0
+            if clear and \
+               size + len(word) + 1 <= length and \
+               not self.random.randrange(self.sparsity):
+                wing.append(word)
+                size += len(word) + 1
+            i = (i + 1) % n
+        if self.stats is not None:
+            self.stats.wing((i - first) % n, len(wing))
+        return ' '.join(wing), i
+
+    def make_unused_wing_words(self, length, i, end, char1, char2):
+        ''' Generates wing text for half of a line of a strict mesostic,
+            as make_wing_words does but going straight from one unused
+            word to the next, and marking the words it takes used.
+
+            (int, int, int, char, char) -> (str, int) '''
+        source, n = self.source, len(self.source)
+        compact = isinstance(source, CompactWords)
+        if compact:
+            ids, table, masks = source.ids, source.table, source.masks
+            avoid = source.letter_mask(char1 + char2)
+        find = self.unused.find
+        wing = []
+        size = 0                # length of the wing words plus a space each
+        considered = 0
+        # the words from i up to end, which may wrap around
+        spans = [(i, end)] if i < end else [(i, n), (0, end)]
+        if i == end: spans = []
+        for first, last in spans:
+            i = find(first)
+            while i < last and size < length:
+                if compact:
+                    word = table[ids[i]]
+                    clear = not masks[ids[i]] & avoid
+                else:
+                    word = source[i]
+                    clear = word.count(char1) == 0 and word.count(char2) == 0
+                if clear and \
+                   size + len(word) + 1 <= length and \
+                   not self.random.randrange(self.sparsity):
+                    wing.append(word)
+                    size += len(word) + 1
+                    self.use(i)
+                considered += 1
+                i = find(i + 1)
+            if size >= length: break
+        if self.stats is not None:
+            self.stats.wing(considered, len(wing))
+        return ' '.join(wing), min(i, last) % n if spans else i
+
+    def format_html(self, lines=None):
         ''' Preformats the mesostic for display in an html page.
             Returns a message saying whether the mesostic was created
             successfully and a list of the mesostic's formatted lines.
+            Formats self.lines, or the given line records if any.
 
-            NoneType -> (str, list of str) '''
-        text = self.poem.strip().split('\n')
-        html = []
-        longest = 0
-        spaces = []
-        s = 0
-
-        for ln in text:
-            if ln.strip():
-                i = ln.index(self.seed[s])        # find the spine letter
-                longest = max(longest, len(ln[:i]))
-                spaces.append(len(ln[:i]))        # record pre-spine length
-                # capitalize spine letter & clothe it in bold tags; append line
-                html.append(ln[:i] + '<b>' + ln[i].upper() + '</b>' + ln[i+1:])
-                s = (s + 1) % len(self.seed)
-            else:
-                spaces.append(0)                  # (else it's a blank line)
-                html.append(ln)
-                # if line breaks are random, no spine ch will indicate blank
-                if self.seed[s] == ' ': s = (s + 1) % len(self.seed)
-                
-        # left-pad each line with spaces to line up the spine
-        # rstrip() to clear the spaces from blank lines
-        spaces = [longest - s for s in spaces]
-        html = [(' '*spaces[i] + html[i]).rstrip() for i in range(len(html))]
-        
+            list of MesoLine -> (str, list of str) '''
+        start = default_timer()
+        html = render_html(self.lines if lines is None else lines)
+        if self.stats is not None:
+            self.stats.add_time('format_html', default_timer() - start)
+        return (self.message(), html)
+
+    def iter_html(self, records, width=45):
+        ''' Preformats line records for display in an html page as they
+            arrive, e.g. from iter_records(). Rather than wait for the
+            longest line, left-pads each line to put the spine in column
+            width (the wing limit). Stanza breaks after the last line
+            are dropped, as in format_html.
+
+            (iterable of MesoLine, int) -> generator of str '''
+        breaks = 0              # blank lines held back until more text
+        for record in records:
+            for b in range(breaks): yield ''
+            before = record.before()
+            yield ' '*(width - len(before)) + before + \
+                  html_letter(record.letter()) + record.after()
+            breaks = record.stanza_break
+
+    def message(self):
+        ''' Returns a message saying whether the mesostic was created
+            successfully.
+
+            NoneType -> str '''
+        if self.exhausted:
+            iteration, line = self.exhausted
+            return 'The source text ran out of unused words for the '+\
+                   'spine letter %s ' % describe_key(spine_key(self.seed,
+                                                               line))+\
+                   'in repetition %d of the spine.' % (iteration + 1)+\
+                   '<br /><br />I got this far:'
         if self.fail:
-            message = 'Could not complete the requested mesostic. The spine '+\
-                      'may not work with that oracle, or it might work once '+\
-                      'but not be able to repeat.<br /><br />I got this far:'
+            return 'Could not complete the requested mesostic. The spine '+\
+                   'may not work with that oracle, or it might work once '+\
+                   'but not be able to repeat.<br /><br />I got this far:'
+        return 'Well glonce-a-day, it worked! Here you go:'
+
+
+class MesosticBatch(object):
+    ''' A batch of mesostics generated from a single oracle, e.g. one
+        per student name as the spine. The oracle is tokenized and
+        indexed once for the whole batch; poems holds the resulting
+        Mesostic objects in job order and elapsed the generation time
+        in seconds. '''
+
+    def __init__(self, text, jobs, strip_punct, normalize=False):
+        ''' Initializes a MesosticBatch and generates its poems. Each
+            job is a (seed, iters, sparsity, break_type) tuple.
+            Takes (str, list of tuple, bool, bool). '''
+        if isinstance(text, Oracle):
+            self.oracle = text
+        else:
+            self.oracle = get_oracle(text, strip_punct, normalize=normalize)
+
+        start = default_timer()
+        self.poems = [Mesostic(self.oracle, seed, iters, sparsity,
+                               strip_punct, break_type)
+                      for seed, iters, sparsity, break_type in jobs]
+        self.elapsed = default_timer() - start
+
+    def failed(self):
+        ''' Returns the poems that could not be completed.
+
+            NoneType -> list of Mesostic '''
+        return [poem for poem in self.poems if poem.fail]
+
+    def poems_per_second(self):
+        ''' Returns the batch's throughput.
+
+            NoneType -> float '''
+        if not self.elapsed:
+            return 0.0
+        return len(self.poems) / self.elapsed
+
+
+def check_spine(text, seed, strip_punct, break_type, normalize=False):
+    ''' Without making a mesostic, finds the spine letters that no word
+        in the oracle can carry. Returns their keys, in spine order.
+
+        (str, str, bool, str, bool) -> list of tuple '''
+    return Mesostic(text, seed, 0, 2, strip_punct, break_type,
+                    normalize=normalize).blocked
+
+
+# Running batches of jobs from the command line. Each job is a JSON
+# object: the path of the oracle (a UTF-8 text or a meso_store index
+# file) and the seed are required; iters, sparsity, break_type, rng,
+# strip_punct, strict, normalize and an id to echo back are optional.
+JOB_DEFAULTS = {'iters': 1, 'sparsity': 2, 'break_type': 'word', 'rng': None,
+                'strip_punct': True, 'strict': False, 'normalize': False}
+
+# the oracles each worker process has loaded, by (path, strip_punct,
+# normalize),
+# least recently used first; at most WORKER_ORACLE_LIMIT are kept open
+WORKER_ORACLES = OrderedDict()
+WORKER_ORACLE_LIMIT = 8
+
+
+def load_job_oracle(path, strip_punct, normalize=False):
+    ''' Returns the Oracle at a path, loading it the first time this
+        process is asked for it. A text file is read through a memory
+        map, unless the index directory has an index file for it.
+
+        (str, bool, bool) -> Oracle '''
+    key = (path, bool(strip_punct), bool(normalize))
+    oracle = WORKER_ORACLES.pop(key, None)
+    if oracle is None:
+        if path.endswith('.psmi'):
+            from meso_store import load_index
+            oracle = load_index(path)
         else:
-            message = 'Well glonce-a-day, it worked! Here you go:'
+            oracle = open_oracle(path, strip_punct, normalize=normalize)
+            oracle = ORACLES.load((oracle.fingerprint,) + oracle.options) \
+                or oracle
+        while len(WORKER_ORACLES) >= WORKER_ORACLE_LIMIT:
+            WORKER_ORACLES.popitem(last=False)
+    WORKER_ORACLES[key] = oracle
+    return oracle
+
+
+def run_job(numbered):
+    ''' Makes the mesostic for a job, given with its line number.
+        Returns whether it was completed, and its result as a line of
+        JSON: the job's line number and id, the line records, the poem
+        text and whether it failed; or the error that stopped it, so
+        one bad job does not stop a batch.
+
+        (int, str) -> (bool, str) '''
+    n, line = numbered
+    info = {'job': n}
+    try:
+        job = json.loads(line)
+        if not isinstance(job, dict):
+            raise ValueError('a job must be a JSON object')
+        if 'id' in job:
+            info['id'] = job['id']
+        spec = dict(JOB_DEFAULTS)
+        spec.update(job)
+        oracle = load_job_oracle(spec['oracle'], spec['strip_punct'],
+                                 spec['normalize'])
+        poem = Mesostic(oracle, spec['seed'], int(spec['iters']),
+                        int(spec['sparsity']), spec['strip_punct'],
+                        spec['break_type'], rng=spec['rng'],
+                        strict=spec['strict'], normalize=spec['normalize'])
+    except Exception as e:
+        info['error'] = '%s: %s' % (type(e).__name__, e)
+        return False, json.dumps(info, sort_keys=True)
+    return not poem.fail, render_json(poem.lines, poem=poem.poem,
+                                      fail=poem.fail, **info)
+
+
+def main(argv=None):
+    ''' Runs JSONL jobs from a file or stdin on a pool of worker
+        processes, writing one JSON result per job to stdout, in job
+        order or as they finish. Returns 1 if any job failed or had an
+        error, else 0.
+
+        list of str -> int '''
+    parser = argparse.ArgumentParser(
+        description='Make mesostics for a file of JSONL jobs.')
+    parser.add_argument('jobs', nargs='?', default='-',
+                        help='file of jobs, one JSON object per line '
+                             '(default: stdin)')
+    parser.add_argument('-j', '--workers', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='worker processes (default: one per core; '
+                             '1 runs the jobs in this process)')
+    parser.add_argument('--unordered', action='store_true',
+                        help='write results as jobs finish, not in order')
+    parser.add_argument('--chunk', type=int, default=1,
+                        help='jobs handed to a worker at a time')
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.jobs == '-' else io.open(args.jobs,
+                                                         encoding='utf-8')
+    jobs = ((n, line) for n, line in enumerate(source, 1) if line.strip())
+    pool = None
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers)
+        run = pool.imap_unordered if args.unordered else pool.imap
+        results = run(run_job, jobs, args.chunk)
+    else:
+        results = (run_job(job) for job in jobs)
+    status = 0
+    try:
+        for done, result in results:
+            if not done:
+                status = 1
+            sys.stdout.write(result + '\n')
+            sys.stdout.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if source is not sys.stdin:
+            source.close()
+    return status
+
 
-        return (message, html)
+if __name__ == '__main__':
+    sys.exit(main())
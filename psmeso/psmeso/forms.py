@@ -1,5 +1,14 @@
 from django import forms
 
+from meso_index import describe_key
+from meso_tokens import clean_seed
+
+def blockedMessages(blocked):
+    ''' Returns a message for each spine letter key no word of the oracle
+    can carry. '''
+    return ['No word in the source text can carry the spine letter ' +
+            describe_key(key) + '.' for key in blocked]
+
 class mesosticForm(forms.Form):
     ORACLE = forms.CharField(label='Source text',
                              widget=forms.Textarea)
@@ -18,4 +27,43 @@ class mesosticForm(forms.Form):
                              choices=((2, 'Normal'),
                                       (4, 'Sparse'),
                                       (8, 'Very Sparse')))
-    strippunct = forms.BooleanField(label='Strip punctuation?', required=False)
\ No newline at end of file
+    strippunct = forms.BooleanField(label='Strip punctuation?', required=False)
+    BRTYPE = forms.ChoiceField(label='Where should stanza breaks go?',
+                               initial='word',
+                               choices=(('word', 'After the spine text'),
+                                        ('random', 'Randomly')))
+    # set to make the same mesostic again, e.g. from a shared link
+    RNG = forms.IntegerField(required=False, min_value=0,
+                             widget=forms.HiddenInput)
+
+    def __init__(self, *args, **kwargs):
+        # checkSpine(oracle, seed, iters, strippunct, brtype) returns the
+        # spine letter keys no word of the oracle can carry
+        self.checkSpine = kwargs.pop('checkSpine', None)
+        super(mesosticForm, self).__init__(*args, **kwargs)
+
+    def clean(self):
+        data = super(mesosticForm, self).clean()
+        if 'SEED' in data and not clean_seed(data['SEED']).strip():
+            raise forms.ValidationError(
+                'The spine text needs at least one letter.')
+        fields = ('ORACLE', 'SEED', 'ITERS', 'BRTYPE')
+        if self.checkSpine and all(f in data for f in fields):
+            blocked = self.checkSpine(data['ORACLE'], data['SEED'],
+                                      data['ITERS'], data.get('strippunct'),
+                                      data['BRTYPE'])
+            if blocked:
+                raise forms.ValidationError(blockedMessages(blocked))
+        return data
+
+
+class extendForm(forms.Form):
+    TOKEN = forms.CharField(widget=forms.HiddenInput)
+    ORACLE = forms.CharField(label='Source text',
+                             widget=forms.Textarea)
+    ITERS = forms.IntegerField(label='How many more times should the spine '+\
+                                     'text appear (1 - 99)?',
+                               initial='1',
+                               min_value=1,
+                               max_value=99,
+                               widget=forms.TextInput(attrs={'size': '3'}))
@@ -0,0 +1,164 @@
+''' Background jobs for P.S.: Meso.
+
+A long mesostic (many iterations of the spine over a huge oracle) would
+hold a request worker for as long as it takes to make. The psmeso view
+estimates what each poem will cost and hands the expensive ones to a
+JobQueue instead: a few worker threads in this process taking jobs off
+an in-process queue, with no broker to run. The browser gets a job id
+straight away and polls (or long-polls) psmeso_job for progress and,
+in the end, the poem.
+
+Jobs live in memory, so they are only found by polling the process that
+took them, and are forgotten keep seconds after they finish. At most
+max_queued jobs wait for a worker; past that, submit raises Full.
+'''
+
+import logging
+import threading
+import time
+import uuid
+
+try:
+    from queue import Full, Queue
+except ImportError:
+    from Queue import Full, Queue
+
+logger = logging.getLogger('psmeso.jobs')
+
+# Poems that cost more than INLINE_COST are made in the background. The
+# cost is in characters of oracle text: tokenizing the oracle reads each
+# one once, and each line of the poem costs about LINE_COST more.
+INLINE_COST = 3000000
+LINE_COST = 1000
+
+
+def estimate_cost(words, seed, iters):
+    """ (str, str, int) -> int
+
+    Estimates the work of making a mesostic from the length of the
+    oracle text and the number of lines: a spine letter per line, iters
+    times over.
+    """
+    return len(words) + LINE_COST * iters * len(seed)
+
+
+class Job(object):
+    """ A call to make in the background, where it stands (queued,
+    running, done or error), how far it has got, and its result or
+    error once it is finished.
+    """
+
+    def __init__(self, fn, args, kwargs):
+        """ (function, tuple, dict) -> NoneType
+
+        Initializes a queued Job that will call fn(*args, **kwargs) with
+        a progress keyword to report through.
+        """
+        self.id = uuid.uuid4().hex
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+        self.state = 'queued'
+        self.done, self.total = 0, None
+        self.result = self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.event = threading.Event()
+
+    def progress(self, done, total):
+        self.done, self.total = done, total
+
+    def run(self):
+        """ (NoneType) -> NoneType
+
+        Makes the call, keeping its result, or the error if it raises.
+        """
+        self.state = 'running'
+        try:
+            self.result = self.fn(*self.args, progress=self.progress,
+                                  **self.kwargs)
+            self.state = 'done'
+        except Exception as e:
+            logger.exception('job %s failed', self.id)
+            self.error = '%s: %s' % (type(e).__name__, e)
+            self.state = 'error'
+        # the arguments hold the oracle text; don't keep it for keep seconds
+        self.fn = self.args = self.kwargs = None
+        self.finished = time.time()
+        self.event.set()
+
+    def wait(self, timeout):
+        """ (float) -> bool
+
+        Waits up to timeout seconds for the job to finish. Returns True
+        iff it has.
+        """
+        return self.event.wait(timeout)
+
+    def as_dict(self):
+        data = {'job': self.id, 'state': self.state,
+                'done': self.done, 'total': self.total}
+        if self.error is not None:
+            data['error'] = self.error
+        return data
+
+
+class JobQueue(object):
+    """ A queue of Jobs worked through by a pool of daemon threads,
+    started with the first job. Finished jobs are kept keep seconds for
+    their results to be picked up. No more than max_queued jobs wait
+    for a worker at once.
+    """
+
+    def __init__(self, workers=2, keep=600, max_queued=20):
+        """ (int, int, int) -> NoneType """
+        self.workers = workers
+        self.keep = keep
+        self.jobs = {}
+        self.queue = Queue(max_queued)
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """ (function, ...) -> Job
+
+        Queues a call to fn(*args, progress=..., **kwargs). Raises Full
+        if max_queued jobs are already waiting.
+        """
+        job = Job(fn, args, kwargs)
+        with self.lock:
+            self.prune()
+            self.queue.put_nowait(job)
+            self.jobs[job.id] = job
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.work,
+                                          name='psmeso-job-%d'
+                                               % len(self.threads))
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        return job
+
+    def get(self, job_id):
+        """ (str) -> Job
+
+        Returns the job of an id, or None if there is none (any more).
+        """
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def work(self):
+        while True:
+            self.queue.get().run()
+
+    def prune(self):
+        """ (NoneType) -> NoneType
+
+        Forgets jobs that finished more than keep seconds ago. Call with
+        the lock held.
+        """
+        limit = time.time() - self.keep
+        for job_id in [job.id for job in self.jobs.values()
+                       if job.finished is not None and job.finished < limit]:
+            del self.jobs[job_id]
+
+
+JOBS = JobQueue()
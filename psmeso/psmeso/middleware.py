@@ -0,0 +1,34 @@
+''' Request middleware for P.S.: Meso.
+
+MesoStatsMiddleware gives each request a MesoStats (as
+request.meso_stats) for the mesostic views to fill in. After the
+response it logs the statistics to the 'psmeso.stats' logger and sends
+the phase times in a Server-Timing header. Streamed pages are still
+being made when the response leaves the view, so they log their own
+statistics at the end of the stream and get no header.
+
+To turn it on, add 'psmeso.middleware.MesoStatsMiddleware' to the
+MIDDLEWARE (or MIDDLEWARE_CLASSES) setting. Without it, the views keep
+no statistics.
+'''
+
+from meso_stats import MesoStats
+
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:
+    MiddlewareMixin = object
+
+
+class MesoStatsMiddleware(MiddlewareMixin):
+
+    def process_request(self, request):
+        request.meso_stats = MesoStats()
+
+    def process_response(self, request, response):
+        stats = getattr(request, 'meso_stats', None)
+        if stats is not None and stats.phases and \
+           not getattr(response, 'streaming', False):
+            stats.log()
+            response['Server-Timing'] = stats.server_timing()
+        return response
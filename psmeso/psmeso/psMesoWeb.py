@@ -16,276 +16,442 @@ beginning to find suitable words.
 '''
 
 import random
+from timeit import default_timer
+
+import meso_numpy
+from meso_cache import POEMS
+from meso_lines import MesoLine, html_letter, render
+from meso_oracle import get_oracle
+from meso_tokens import clean_seed
+
+
+def mesosticize(words, seed, iters, odds, strip_punct, brtype,
+                vectorize=False, rng=None, stats=None, progress=None,
+                normalize=False):
+    """ (str, str, int, int, bool, str, bool, int, MesoStats, function,
+        bool) -> (str, list of str)
+
+    Makes a mesostic and formats it for html. All generation state lives
+    in a MesoContext of its own, so requests in different threads don't
+    disturb each other. Given an rng seed, the same inputs always make
+    the same mesostic, and one made before comes from the result cache.
+    Given a MesoStats, records how the mesostic was made in it. Given a
+    progress function, calls it with the iterations done and iters after
+    each iteration of the spine. With normalize, the oracle and spine are
+    NFKC-normalized and casefolded rather than lowercased.
+    """
+    start = default_timer()
+    context = MesoContext(words, seed, iters, odds, strip_punct, brtype,
+                          vectorize, rng, stats, progress, normalize)
+    if stats is not None:
+        stats.add_time('__init__', default_timer() - start)
+
+    key = context.cacheKey()
+    cached = POEMS.get(key) if key else None
+    if cached:
+        return (cached[0], list(cached[1]))
+
+    start = default_timer()
+    meso, fail = context.mesostic()
+    if stats is not None:
+        stats.add_time('mesostic', default_timer() - start)
+        start = default_timer()
+    message, meso = context.formatHtml(meso, fail)
+    if stats is not None:
+        stats.add_time('formatHtml', default_timer() - start)
+
+    if key:
+        POEMS.put(key, (message, tuple(meso)))
+    return (message, meso)
 
-# create global variables
-ORACLE, SEED, ITERS, ODDS = [], '', 1, 2
-OLENGTH, SEEDLIM = 0, 0
-lastCap, nowCap, nextCap = ' ', ' ', ' '
-BRTYPE = ''
 
+def mesosticRecords(words, seed, iters, odds, strip_punct, brtype,
+                    vectorize=False, rng=None, stats=None, normalize=False):
+    """ (str, str, int, int, bool, str, bool, int, MesoStats, bool)
+        -> (list of MesoLine, bool)
 
-def mesosticize(words, seed, iters, odds, strip_punct, brtype):
-    initializeVars(words, seed, iters, odds, strip_punct, brtype)
+    Makes a mesostic as mesosticize does, but returns its line records
+    and whether it failed rather than formatting it, for callers that
+    lay it out themselves. Records are cached apart from html.
+    """
+    context = MesoContext(words, seed, iters, odds, strip_punct, brtype,
+                          vectorize, rng, stats, normalize=normalize)
+    key = context.cacheKey()
+    if key:
+        key += ('records',)
+    cached = POEMS.get(key) if key else None
+    if cached:
+        return (list(cached[0]), cached[1])
+
+    start = default_timer()
+    meso, fail = context.mesostic()
+    if stats is not None:
+        stats.add_time('mesostic', default_timer() - start)
+    if key:
+        POEMS.put(key, (tuple(meso), fail))
+    return (meso, fail)
 
-    meso, fail = mesostic()
-    message, meso = formatHtml(meso, fail)
 
-    return (message, meso)
+def checkSpine(words, seed, iters, strip_punct, brtype, normalize=False):
+    """ (str, str, int, bool, str, bool) -> list of tuple
 
+    Without making the mesostic, finds the spine letters that no word in
+    the oracle can carry. Returns their (last, now, next) keys.
+    """
+    context = MesoContext(words, seed, iters, 2, strip_punct, brtype,
+                          normalize=normalize)
+    return [key for j, key, count in context.spineReport() if not count]
 
-def initializeVars(words, seed, iters, odds, strip_punct, brtype):
-    """ (str, str, int, int, bool) -> NoneType
 
-    Cleans the inputs and uses them to initialize the global variables.
+class MesoContext(object):
+    """ The inputs and working state of one mesostic in the making: the
+    cleaned oracle and seed, the iterations and odds, the stanza break
+    type, and the last, current & next spine letters.
     """
-    global ORACLE, SEED, ITERS, ODDS, OLENGTH, SEEDLIM, lastCap, nowCap, nextCap
-    global BRTYPE
-    PUNCT = u'.,;:?/|\\\'\"-!%^&*()[]{}<>_=+~`@#$%¡¿«»–—‘’“”'
-
-    ''' Initialize the stanza break type - random or after words '''
-    BRTYPE = brtype
-
-    ''' Initialize the number of times to repeat the seed text (spine)'''
-    ITERS = iters
-
-    ''' Initialize the odds determining sparsity of fill text '''
-    ODDS = odds
-
-    ''' Initialize the oracle text '''
-    words = words.lower().split()
-
-    # If the user checked the "strip punctuation" box, do so (oracle only)
-    if strip_punct:
-        for i in range(len(words)):
-            words[i] = words[i].strip(PUNCT)
-
-    # Copy non-empty-string items to the final list, excluding numbers
-    # (this is to remove section numbers like those in Song of Myself)
-    parsed = []
-    for i in words:
-        if i and not i.isdigit():
-            parsed.append(i.lower())
-    ORACLE = parsed
-
-    ''' Initialize the seed text, stripping punctuation and spaces,
-        and modifying for random or word stanza breaks '''
-    SEED = seed.strip().lower()
-    for ch in PUNCT:
-        SEED = SEED.replace(ch, '')
-    if BRTYPE == 'random':
-        SEED = SEED.replace(' ', '')
-    else:
-        SEED += ' '
-
-    ''' Set the oracle list length and seed index limit constants '''
-    OLENGTH = len(ORACLE)
-    SEEDLIM = len(SEED) - 1
-
-    ''' Initialize the vars tracking last, current, & next spine letter '''
-    lastCap, nowCap, nextCap = ' ', SEED[0], SEED[1]
-
-
-def mesostic():
-    ''' (list of str, int) -> str
-    Given an oracle, seed text (global), and the number of iterations,
-    make a mesostic.
-    '''
-
-    place, k, spine = 0, 0, ''
-    meso = ''
-    fail = False
-
-    # Runs the generator iters times on the seed text.
-    # If it cannot complete a single iteration, it will error out
-    for i in range(ITERS):
-        for j in range(len(SEED)):
-            oldPlace = place
-            oldSpine = spine
-            oldK = k
-            spine, place, k, fail = nextSpineWord(j, place, i)
+
+    def __init__(self, words, seed, iters, odds, strip_punct, brtype,
+                 vectorize=False, rng=None, stats=None, progress=None,
+                 normalize=False):
+        """ (str, str, int, int, bool, str, bool, int, MesoStats, function,
+            bool) -> NoneType
+
+        Cleans the inputs and uses them to initialize the context.
+        If vectorize is set and NumPy is installed, fill text is chosen by
+        the NumPy engine. All random choices come from a private random
+        number generator seeded with rng. Searches and fill text are
+        counted in stats, if given, and progress is told of each
+        iteration of the spine done. With normalize, the oracle and seed
+        are NFKC-normalized and casefolded rather than lowercased.
+        """
+
+        ''' Initialize the statistics, if any are to be kept '''
+        self.stats = stats
+        self.progress = progress
+
+        ''' Initialize the random number generator '''
+        self.rng = rng
+        self.random = random.Random(rng)
+
+        ''' Initialize the stanza break type - random or after words '''
+        self.brtype = brtype
+
+        ''' Initialize the number of times to repeat the seed text (spine)'''
+        self.iters = iters
+
+        ''' Initialize the odds determining sparsity of fill text '''
+        self.odds = odds
+
+        ''' Initialize the oracle text '''
+        # If the user checked the "strip punctuation" box, strip it (oracle
+        # only); drop empty strings and numbers (this is to remove section
+        # numbers like those in Song of Myself). The tokenized oracle is
+        # cached and shared with other requests for the same text.
+        oracle = get_oracle(words, strip_punct, drop_digits=True,
+                            normalize=normalize)
+        self.oracle, self.index = oracle.words, oracle.index
+        self.fingerprint, self.options = oracle.fingerprint, oracle.options
+
+        ''' Initialize the NumPy fill text engine, if asked for '''
+        self.wings = None
+        if vectorize and meso_numpy.available:
+            self.wings = meso_numpy.WingPicker(self.oracle,
+                                               self.random.randrange(1 << 32))
+
+        ''' Initialize the seed text, stripping punctuation and spaces,
+            and modifying for random or word stanza breaks '''
+        self.seed = clean_seed(seed, normalize)
+        if self.brtype == 'random':
+            self.seed = self.seed.replace(' ', '')
+        else:
+            self.seed += ' '
+
+        ''' Set the oracle list length and seed index limit constants '''
+        self.olength = len(self.oracle)
+        self.seedlim = len(self.seed) - 1
+
+        ''' Initialize the vars tracking last, current, & next spine letter '''
+        self.lastCap, self.nowCap, self.nextCap = ' ', self.seed[:1], \
+                                                  self.seed[1:2]
+
+    def cacheKey(self):
+        ''' (NoneType) -> tuple
+
+        The result cache key for this mesostic, or None if it was not
+        given an rng seed.
+        '''
+        if self.rng is None:
+            return None
+        return ('psMesoWeb', self.fingerprint, self.options, self.seed,
+                self.iters, self.odds, self.brtype, self.wings is not None,
+                self.rng)
+
+    def spineKey(self, last, now, next):
+        ''' (str, str, str) -> tuple
+
+        The spine index key for a spine letter and its neighbours. Rule 1
+        here only looks for the next letter after the spine letter, so a
+        next letter like the spine letter itself never rules a word out.
+        '''
+        return (last.strip() or None, now,
+                None if next == now else next.strip() or None)
+
+    def spineReport(self):
+        ''' (NoneType) -> list of (int, tuple, int)
+
+        For each letter of the seed, counts the words in the oracle that
+        could carry it, as (seed position, key, count). The first letter
+        has no last letter in the first iteration, nor the last letter a
+        next one in the last, so those letters may have more than one key.
+        '''
+        report = []
+        for j in range(len(self.seed)):
+            if self.seed[j] == ' ':
+                continue
+            # the neighbours differ only in the first & last iterations
+            keys = []
+            for i in sorted(set([0, 1, self.iters-1]) & set(range(self.iters))):
+                last, next = self.seed[j-1], self.seed[(j+1)%(self.seedlim+1)]
+                if i == 0 and j == 0:
+                    last = ' '
+                if i == self.iters-1 and j == self.seedlim:
+                    next = ' '
+                key = self.spineKey(last, self.seed[j], next)
+                if key not in keys:
+                    keys.append(key)
+                    report.append((j, key, len(self.index.candidates(key))))
+        return report
+
+    def mesostic(self):
+        ''' (NoneType) -> (list of MesoLine, bool)
+        Given an oracle, seed text, and the number of iterations (all in the
+        context),
+        make a mesostic: a record of each line, and whether it failed.
+        '''
+
+        place, k, spine = 0, 0, ''
+        meso = []
+        fail = False
+
+        # Runs the generator iters times on the seed text.
+        # If it cannot complete a single iteration, it will error out
+        for i in range(self.iters):
+            for j in range(len(self.seed)):
+                oldPlace = place
+                oldSpine = spine
+                oldK = k
+                spine, place, k, fail = self.nextSpineWord(j, place, i)
+                if fail:
+                    break
+                right, stanzaBreak, left = self.fillText(oldPlace, place-1,
+                                                         oldSpine, spine,
+                                                         oldK, k)
+                # The fill ends the last line (if it wasn't blank) and
+                # starts this one; a blank spine word is a stanza break
+                if oldSpine.strip():
+                    meso[-1].right = right
+                if meso:
+                    meso[-1].stanza_break += stanzaBreak
+                if spine == ' ':
+                    if meso:
+                        meso[-1].stanza_break += 1
+                else:
+                    meso.append(MesoLine(left, spine, k))
             if fail:
                 break
-            fill = fillText(oldPlace, place-1, oldSpine, spine, oldK, k)
-            meso += (fill + spine)
-        if fail:
-            break
+            if self.progress is not None:
+                self.progress(i + 1, self.iters)
+
+        return (meso, fail)
+
+    def nextSpineWord(self, j, place, iteration):
+        ''' (int, int) -> str
+
+        Finds the spine word for the next line of the mesostic.
+
+        Go through the letters of the seed one by one.
+    `   If a word contains the current letter ONCE, check that it meets
+        rule 1; if the the prev letter doesn't appear before the current
+        AND the next don't appear after the current, it is the word.
+        '''
+
+        self.nowCap = self.seed[j]
+        # On the first seed letter of the first iteration, leave lastCap a space;
+        # after, it's the prev. char
+        if iteration != 0 or j != 0:
+            self.lastCap = self.seed[j-1]
+        # On the last seed letter in the last iteration, make nextCap a space;
+        # before, it's the next char
+        if iteration != self.iters-1 or j != self.seedlim:
+            self.nextCap = self.seed[(j+1)%(self.seedlim+1)]
+        else:
+            self.nextCap = ' '
 
-    return (meso, fail)
+        incomplete = False
+        i = 0
+        start = place
+        rejects = 0
 
+        # If no word in the oracle can carry the letter, fail right away
+        # rather than after reading through the whole oracle
+        if self.nowCap != ' ' and not self.index.candidates(
+                self.spineKey(self.lastCap, self.nowCap, self.nextCap)):
+            return ('', place, i, True)
 
-def nextSpineWord(j, place, iteration):
-    ''' (int, int) -> str
-
-    Finds the spine word for the next line of the mesostic.
-
-    Go through the letters of the seed one by one.
-`   If a word contains the current letter ONCE, check that it meets
-    rule 1; if the the prev letter doesn't appear before the current
-    AND the next don't appear after the current, it is the word.
-    '''
-
-    global lastCap, nowCap, nextCap
-    nowCap = SEED[j]
-    # On the first seed letter of the first iteration, leave lastCap a space;
-    # after, it's the prev. char
-    if iteration != 0 or j != 0:
-        lastCap = SEED[j-1]
-    # On the last seed letter in the last iteration, make nextCap a space;
-    # before, it's the next char
-    if iteration != ITERS-1 or j != SEEDLIM:
-        nextCap = SEED[(j+1)%(SEEDLIM+1)]
-    else:
-        nextCap = ' '
-
-    incomplete = False
-    i = 0
-    start = place
-
-    # Find the next word with one instance of the spine letter
-    fits = False
-
-    # but if the spine char is a space, return a blank spine word
-    if nowCap == ' ':
-        word = ' '
-        fits = True
-    
-    while fits == False:
-        word = ORACLE[place]
-        while word.count(nowCap) != 1:
-            place += 1
-            if place == OLENGTH:
-                place = 0
-            if place == start:
-                incomplete = True
-                break
-            word = ORACLE[place]
+        # Find the next word with one instance of the spine letter
+        fits = False
 
-        # Move past the current word so it's not checked repeatedly
-        place += 1
-        if place == OLENGTH:
-            place = 0
+        # but if the spine char is a space, return a blank spine word
+        if self.nowCap == ' ':
+            word = ' '
+            fits = True
 
-        if incomplete:
-            word = ''
-            break
+        while fits == False:
+            word = self.oracle[place]
+            while word.count(self.nowCap) != 1:
+                place += 1
+                if place == self.olength:
+                    place = 0
+                if place == start:
+                    incomplete = True
+                    break
+                word = self.oracle[place]
+
+            # Move past the current word so it's not checked repeatedly
+            place += 1
+            if place == self.olength:
+                place = 0
 
-        # Check that it meets mesostic rule #1
-        i = word.index(nowCap)
-        if word.find(lastCap, 0, i)==-1 and word.find(nextCap, i+1)==-1:
-            fits = True
+            if incomplete:
+                word = ''
+                break
 
-    return (word, place, i, incomplete)
-
-
-def fillText(place1, place2, spine1, spine2, k1, k2):
-    ''' (int*6) -> str
-
-    After the spine word on one line and before the spine word on the next
-    add some words that meet rules #1 and #2. Make it a bit random
-    (qualified words to include and line breaks to place).
-    '''
-
-    limit1 = 45 - len(spine1[k1+1:])
-    limit2 = 45 - len(spine2[:k2])
-    line1, line2 = '', ''
-
-    # correct for possibility that place2 is at the beginning of
-    # the oracle and place1 at the end
-    effectiveP1 = place1
-    if place1 > place2:
-        effectiveP1 -= OLENGTH
-
-    # Old line (only if there's a previous spine word):
-    # Word must appear between prev & next spine words in oracle;
-    # user-defined odds determine whether to try to add the word; if yes,
-    # the word must not contain the prev or next spine letter and
-    # must be short enough to fit within the line limit. If yes, it's added.
-    if spine1 and spine1 != ' ':
-        while effectiveP1 < place2 and random.randrange(ODDS) == 0:
-            word = ORACLE[place1]
-            if lastCap not in word and nowCap not in word:
-                if len(line1) + len(word) <= limit1:
-                    line1 += ' '+word
-            effectiveP1 += 1
-            place1 += 1
-            if place1 == OLENGTH:
-                place1 = 0
-
-    # Old line done. Add line break.
-    line1 += '\n'
-
-    # Randomly add another line break (new stanza). Odds: 1 in 7.
-    # Only if stanza break type is random.
-    if BRTYPE == 'random' and random.randrange(1, 8) < 2:
-        line1 += '\n'
-
-    # If next spine word is blank & break type is after words, add break.
-    if spine2 == ' ':
-        line2 += ' '
-    # New line (only if there's a next spine word).
-    # Same rules, new line. Should these be a subfunction?
-    elif spine2:
-        while effectiveP1 < place2 and random.randrange(ODDS) == 0:
-            word = ORACLE[place1]
-            if lastCap not in word and nowCap not in word:
-                if len(line2) + len(word) <= limit2:
-                    line2 += word+' '
-            effectiveP1 += 1
-            place1 += 1
-            if place1 == OLENGTH:
-                place1 = 0
-
-    return (line1 + line2)
-
-
-def formatHtml(text, fail):
-    """ (str) -> list of str
-
-    Clothes the capitalized letter in each line with html bold tags,
-    converts the mesostic string to a list splitting \n new lines into
-    new empty-string elements (which will be displayed as blank lines
-    by the template) so that it is ready to print in html <pre> tags.
-
-    The Django template will use a for loop to display the list element
-    by element (one element per line), as the pure Python version does.
-    """
+            # Check that it meets mesostic rule #1
+            i = word.index(self.nowCap)
+            if word.find(self.lastCap, 0, i)==-1 and \
+               word.find(self.nextCap, i+1)==-1:
+                fits = True
+            else:
+                rejects += 1
+
+        if self.stats is not None and self.nowCap != ' ':
+            found = (place - 1) % self.olength
+            examined = (found - start) % self.olength + 1
+            if incomplete:
+                examined = self.olength
+            self.stats.spine_search(examined, incomplete or found < start,
+                                    rejects)
+
+        return (word, place, i, incomplete)
+
+    def fillText(self, place1, place2, spine1, spine2, k1, k2):
+        ''' (int*6) -> (str, int, str)
+
+        After the spine word on one line and before the spine word on the next
+        add some words that meet rules #1 and #2. Make it a bit random
+        (qualified words to include and line breaks to place). Returns the
+        right wing of the one line, the stanza breaks after it, and the
+        left wing of the next.
+        '''
+
+        limit1 = 45 - len(spine1[k1+1:])
+        limit2 = 45 - len(spine2[:k2])
+        line1, line2 = '', ''
+
+        # The oracle is CompactWords: a word may be added only if its letter
+        # bits miss both spine letters' bits
+        ids, masks = self.oracle.ids, self.oracle.masks
+        avoid = self.oracle.letter_mask(self.lastCap + self.nowCap)
+
+        # correct for possibility that place2 is at the beginning of
+        # the oracle and place1 at the end
+        effectiveP1 = place1
+        if place1 > place2:
+            effectiveP1 -= self.olength
+
+        # Old line (only if there's a previous spine word):
+        # Word must appear between prev & next spine words in oracle;
+        # user-defined odds determine whether to try to add the word; if yes,
+        # the word must not contain the prev or next spine letter and
+        # must be short enough to fit within the line limit. If yes, it's added.
+        if spine1 and spine1 != ' ' and self.wings:
+            picked, read = self.wings.pick_legacy(limit1, place1,
+                                                  place2 - effectiveP1,
+                                                  avoid, self.odds)
+            line1 = ''.join(' ' + self.oracle[k] for k in picked)
+            effectiveP1 += read
+            place1 = (place1 + read) % self.olength
+            if self.stats is not None:
+                self.stats.wing(read, len(picked))
+        elif spine1 and spine1 != ' ':
+            first = effectiveP1
+            while effectiveP1 < place2 and \
+                  self.random.randrange(self.odds) == 0:
+                word = self.oracle[place1]
+                if not masks[ids[place1]] & avoid:
+                    if len(line1) + len(word) <= limit1:
+                        line1 += ' '+word
+                effectiveP1 += 1
+                place1 += 1
+                if place1 == self.olength:
+                    place1 = 0
+            if self.stats is not None:
+                self.stats.wing(effectiveP1 - first, line1.count(' '))
+
+        # Old line done.
+        # Randomly add a stanza break. Odds: 1 in 7.
+        # Only if stanza break type is random.
+        stanzaBreak = 0
+        if self.brtype == 'random' and self.random.randrange(1, 8) < 2:
+            stanzaBreak = 1
+
+        # New line (only if there's a next spine word; if it is blank, the
+        # break type is after words and there is no new line).
+        # Same rules, new line. Should these be a subfunction?
+        if spine2 and spine2 != ' ' and self.wings:
+            picked, read = self.wings.pick_legacy(limit2, place1,
+                                                  place2 - effectiveP1,
+                                                  avoid, self.odds)
+            line2 = ''.join(self.oracle[k] + ' ' for k in picked)
+            if self.stats is not None:
+                self.stats.wing(read, len(picked))
+        elif spine2 and spine2 != ' ':
+            first = effectiveP1
+            while effectiveP1 < place2 and \
+                  self.random.randrange(self.odds) == 0:
+                word = self.oracle[place1]
+                if not masks[ids[place1]] & avoid:
+                    if len(line2) + len(word) <= limit2:
+                        line2 += word+' '
+                effectiveP1 += 1
+                place1 += 1
+                if place1 == self.olength:
+                    place1 = 0
+            if self.stats is not None:
+                self.stats.wing(effectiveP1 - first, line2.count(' '))
+
+        return (line1[1:], stanzaBreak, line2[:-1])
+
+    def formatHtml(self, meso, fail):
+        """ (list of MesoLine, bool) -> (str, list of str)
+
+        Clothes the capitalized letter in each line with html bold tags and
+        lines up the spine, making each stanza break an extra element (which
+        will be displayed as a blank line by the template) so that it is
+        ready to print in html <pre> tags. A stanza break after words keeps
+        its blank spine letter.
+
+        The Django template will use a for loop to display the list element
+        by element (one element per line), as the pure Python version does.
+        """
+
+        blank = '<b> </b> ' if self.brtype != 'random' else ''
+        output = render(meso, html_letter, lambda width: ' ' * width + blank)
+
+        # Now create the introductory message (blank if successful)
+        message = 'Well glonce-a-day, it worked! Here you go:'
+        if fail:
+            message = 'Could not complete the requested mesostic. The spine '+ \
+                      'might not work with that oracle, or it might work once '+ \
+                      'but not be able to repeat.<br /><br />I got this far:'
 
-    text = list(text.strip().split('\n'))
-    output = []
-    longest = 0
-    lineLen = []
-    s = 0
-
-    for line in text:
-        if line:
-            # Find the spine letter
-            i = line.index(SEED[s])
-            s += 1
-            if s > SEEDLIM:
-                s = 0
-            # Record pre-spine length and update longest length;
-            # for adding spaces later so the spine lines up
-            length = len(line[:i])
-            lineLen.append(length)
-            longest = max(longest, length)
-            # Capitalize the spine letter and clothe it in bold tags
-            spine = '<b>' + line[i].upper() + '</b>'
-            output.append(line[:i] + spine + line[i+1:])
-        else:
-            # (It's a blank line)
-            lineLen.append(0)
-            output.append(line)
-
-    # Now, add spaces to line up the spine
-    for i in range(len(output)):
-        spaces = ' ' * (longest - lineLen[i])
-        output[i] = spaces + output[i]
-
-    # Now create the introductory message (blank if successful)
-    message = 'Well glonce-a-day, it worked! Here you go:'
-    if fail:
-        message = 'Could not complete the requested mesostic. The spine '+ \
-                  'might not work with that oracle, or it might work once '+ \
-                  'but not be able to repeat.<br /><br />I got this far:'
-
-    return (message, output)
+        return (message, output)
@@ -1,33 +1,290 @@
+import json
+import random
 from datetime import datetime
-from django.views.decorators.csrf import csrf_protect
+from timeit import default_timer
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.shortcuts import render
-from django.shortcuts import render_to_response
-from django.http import HttpResponseRedirect
+from django.core import signing
+from django.http import HttpResponseRedirect, StreamingHttpResponse
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.template.loader import render_to_string
+from django.utils.html import escape
+
+RNG_LIMIT = 1 << 31
+
+def seeded(data):
+    ''' Returns the cleaned data of a mesosticForm with an RNG seed,
+    drawing one if none was given. A seeded mesostic is cached, and the
+    result page can offer to make the same one again. '''
+    data = dict(data)
+    if data.get('RNG') is None:
+        data['RNG'] = random.randrange(RNG_LIMIT)
+    return data
 
 def home(request):
     return render(request, 'home.html', {'right_now':datetime.utcnow()})
 
+BUSY = ("Lots of long mesostics are being made right now, so there's no "
+        "room for yours. Please try again in a few minutes.")
+
+def checked_mesosticize(ORACLE, SEED, ITERS, ODDS, strippunct, BRTYPE,
+                        **kwargs):
+    ''' Makes a mesostic as psMesoWeb.mesosticize does, for a background
+    job: the spine is checked here rather than in the form, since that
+    tokenizes the oracle. If no word can carry some spine letter, the
+    message says so and there is no mesostic. '''
+    from forms import blockedMessages
+    import psMesoWeb
+    blocked = psMesoWeb.checkSpine(ORACLE, SEED, ITERS, strippunct, BRTYPE)
+    if blocked:
+        return ('<br />'.join(escape(m) for m in blockedMessages(blocked)),
+                [])
+    return psMesoWeb.mesosticize(ORACLE, SEED, ITERS, ODDS, strippunct,
+                                 BRTYPE, **kwargs)
+
 @csrf_protect
 def psmeso(request):
     from forms import mesosticForm
+    import jobs
+    import psMesoWeb
     #c = {}
     if request.method == 'POST':
-        form = mesosticForm(request.POST)
+        # Long poems are made in the background; the page polls
+        # psmeso_job for them. Their spines are checked in the job.
+        def check(oracle, seed, iters, strip, brtype):
+            if jobs.estimate_cost(oracle, seed, iters) > jobs.INLINE_COST:
+                return []
+            return psMesoWeb.checkSpine(oracle, seed, iters, strip, brtype)
+        form = mesosticForm(request.POST, checkSpine=check)
         if form.is_valid():
-            ORACLE = form.cleaned_data['ORACLE']
-            SEED = form.cleaned_data['SEED']
-            ITERS = form.cleaned_data['ITERS']
-            ODDS = int(form.cleaned_data['ODDS'])
-            strippunct = form.cleaned_data['strippunct']
-            import psMesoWeb
+            data = seeded(form.cleaned_data)
+            ORACLE = data['ORACLE']
+            SEED = data['SEED']
+            ITERS = data['ITERS']
+            ODDS = int(data['ODDS'])
+            strippunct = data['strippunct']
+            BRTYPE = data['BRTYPE']
+            RNG = data['RNG']
+            if jobs.estimate_cost(ORACLE, SEED, ITERS) > jobs.INLINE_COST:
+                try:
+                    job = jobs.JOBS.submit(checked_mesosticize, ORACLE, SEED,
+                                           ITERS, ODDS, strippunct, BRTYPE,
+                                           rng=RNG)
+                except jobs.Full:
+                    return render(request, 'mesosticize.html',
+                                  {'message': BUSY, 'mesostic': [],
+                                   'again': data,
+                                   'again_action': request.path}, status=503)
+                return render(request, 'mesosticize_job.html',
+                              {'job': job.id, 'again': data,
+                               'again_action': request.path}, status=202)
+            stats = getattr(request, 'meso_stats', None)
             message, mesostic = psMesoWeb.mesosticize(ORACLE, SEED, ITERS, ODDS,
-                                                      strippunct)
-            return render_to_response('mesosticize.html',
-                                     {'message': message, 'mesostic': mesostic})
+                                                      strippunct, BRTYPE,
+                                                      rng=RNG, stats=stats)
+            return render(request, 'mesosticize.html',
+                          {'message': message, 'mesostic': mesostic,
+                           'again': data, 'again_action': request.path})
+    else:
+        form = mesosticForm()
+    return render(request, 'ps.html', {'form': form})
+
+@csrf_protect
+def psmeso_stream(request):
+    ''' Like psmeso, but sends the mesostic to the browser line by line
+    as it is generated, so the first lines show up without waiting for
+    the whole poem. The outcome message follows the poem. '''
+    from forms import mesosticForm
+    import ps_meso
+    if request.method == 'POST':
+        # ps_meso's spine letters are the same in every iteration
+        check = lambda oracle, seed, iters, strip, brtype: \
+            ps_meso.check_spine(oracle, seed, strip, brtype)
+        form = mesosticForm(request.POST, checkSpine=check)
+        if form.is_valid():
+            data = seeded(form.cleaned_data)
+            poem = ps_meso.Mesostic(data['ORACLE'], data['SEED'],
+                                    data['ITERS'], int(data['ODDS']),
+                                    data['strippunct'], data['BRTYPE'],
+                                    stream=True, rng=data['RNG'],
+                                    stats=getattr(request, 'meso_stats',
+                                                  None))
+            return StreamingHttpResponse(stream_page(poem, request, data))
     else:
         form = mesosticForm()
     return render(request, 'ps.html', {'form': form})
 
+MAX_WAIT = 30
+
+def psmeso_job(request, job_id):
+    ''' Reports on a mesostic being made in the background: its state
+    (queued, running, done or error) and the iterations of the spine done
+    so far, with the message and mesostic once it is done. Given a wait
+    parameter, waits up to that many seconds (at most MAX_WAIT) for the
+    job to finish before answering. '''
+    import jobs
+    job = jobs.JOBS.get(job_id)
+    if job is None:
+        return JsonResponse({'error': 'No such job.'}, status=404)
+    try:
+        wait = min(float(request.GET.get('wait', 0)), MAX_WAIT)
+    except ValueError:
+        return HttpResponseBadRequest('wait must be a number of seconds.')
+    if wait > 0:
+        job.wait(wait)
+    data = job.as_dict()
+    if job.state == 'done':
+        data['message'], data['mesostic'] = job.result
+    return JsonResponse(data)
+
+def stream_page(poem, request=None, again=None):
+    ''' Yields the mesosticize.html page for a stream-mode Mesostic in
+    pieces: everything up to the poem, each formatted line as soon as
+    it is made, then the rest of the page with the message. The message
+    carries a token for psmeso_extend to add more of the poem; given the
+    form data it was made from, the page offers to make it again. '''
+    mark = '<!--mesostic-->'
+    page = render_to_string('mesosticize.html',
+                            {'message': '', 'mesostic': [mark],
+                             'again': again,
+                             'again_action': request and request.path},
+                            request=request)
+    head, tail = page.split(mark + '<br />', 1)
+    yield head
+    start = default_timer()
+    for line in poem.iter_html(poem.iter_records()):
+        yield line + '<br />'
+    message = '<p data-continuation="%s">%s</p>' % (continuation(poem),
+                                                    poem.message())
+    yield tail.replace('</pre>', '</pre>\n' + message, 1)
+    if poem.stats is not None:
+        poem.stats.add_time('stream', default_timer() - start)
+        poem.stats.log()
+
+def continuation(poem):
+    ''' Returns a signed token holding where a Mesostic stopped, or ''
+    if it cannot be carried on. '''
+    if poem.fail:
+        return ''
+    return signing.dumps(poem.continuation(), salt='psmeso.extend',
+                         compress=True)
+
+@csrf_protect
+def psmeso_extend(request):
+    ''' Carries on with a streamed mesostic: takes the token that came
+    with it, its source text and how many more iterations of the spine
+    to make, and returns only the new lines, laid out as the stream
+    laid out the first, with a token to carry on again. '''
+    from forms import extendForm
+    import ps_meso
+    if request.method != 'POST':
+        return HttpResponseBadRequest('POST a token, source text & ITERS.')
+    form = extendForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    try:
+        state = signing.loads(form.cleaned_data['TOKEN'],
+                              salt='psmeso.extend')
+        poem = ps_meso.Mesostic.resume(form.cleaned_data['ORACLE'], state,
+                                       stats=getattr(request, 'meso_stats',
+                                                     None))
+    except (signing.BadSignature, ValueError, KeyError) as e:
+        return JsonResponse({'errors': {'TOKEN': [str(e)]}}, status=400)
+    breaks = [''] * poem.breaks
+    lines = list(poem.iter_html(poem.extend(form.cleaned_data['ITERS'])))
+    return JsonResponse({'message': poem.message(),
+                         'lines': breaks + lines if lines else [],
+                         'token': continuation(poem)})
+
+MAX_BULK = 100
+
+def bulk_cost(specs):
+    ''' Estimates the work of a bulk request as jobs.estimate_cost does
+    for one poem, counting each distinct oracle once, since specs that
+    share an oracle share its tokenizing. Fields that are not what the
+    form takes count for nothing; the form rejects those specs. '''
+    import jobs
+    oracles = set()
+    cost = 0
+    for spec in specs:
+        oracle, seed = spec.get('ORACLE'), spec.get('SEED')
+        try:
+            iters = max(int(spec.get('ITERS', 0)), 0)
+        except (TypeError, ValueError):
+            iters = 0
+        if isinstance(oracle, type(u'')):
+            oracles.add(oracle)
+        if isinstance(seed, type(u'')):
+            cost += jobs.estimate_cost(u'', seed, iters)
+    return cost + sum(len(oracle) for oracle in oracles)
+
+@csrf_exempt
+def psmeso_bulk(request):
+    ''' Makes many mesostics in one POST, for pages that show a gallery
+    of them. Takes a JSON array of specs, each an object with the fields
+    of mesosticForm (ORACLE, SEED, ITERS, ODDS, strippunct, BRTYPE and
+    RNG), or an object with such an array as "specs" and an ORACLE for
+    the specs that have none. Answers with NDJSON: one object per spec,
+    in order, sent as each is made, with its index, its id if it had
+    one, and its line records and failure flag, or its errors. All of
+    it is made in the request, so a request that would cost more than
+    jobs.INLINE_COST, the most the psmeso view makes inline, is refused.
+
+    Only JSON is accepted, which a form on another site cannot send
+    without the browser asking first, so this needs no CSRF token; it
+    only makes poems. '''
+    from forms import mesosticForm
+    if request.method != 'POST':
+        return HttpResponseBadRequest('POST a JSON array of specs.')
+    if request.content_type != 'application/json':
+        return HttpResponseBadRequest('Send the specs as application/json.')
+    try:
+        body = json.loads(request.body.decode('utf-8'))
+    except ValueError as e:
+        return HttpResponseBadRequest('Bad JSON: %s' % e)
+    oracle = None
+    if isinstance(body, dict):
+        oracle, body = body.get('ORACLE'), body.get('specs')
+    if not isinstance(body, list) or \
+       not all(isinstance(spec, dict) for spec in body):
+        return HttpResponseBadRequest('specs must be an array of objects.')
+    if len(body) > MAX_BULK:
+        return HttpResponseBadRequest('At most %d specs at a time.' %
+                                      MAX_BULK)
+    import jobs
+    if oracle is not None:
+        body = [spec if 'ORACLE' in spec else dict(spec, ORACLE=oracle)
+                for spec in body]
+    if bulk_cost(body) > jobs.INLINE_COST:
+        return HttpResponseBadRequest('Those specs are too much to make at '
+                                      'once; send fewer or shorter ones.')
+    forms = [(spec.get('id'), mesosticForm(spec)) for spec in body]
+    return StreamingHttpResponse(bulk_results(forms),
+                                 content_type='application/x-ndjson')
+
+def bulk_results(forms):
+    ''' Yields a line of JSON for each (id, mesosticForm) of a bulk
+    request as its mesostic is made. The tokenized oracle is cached, so
+    specs that share one share its preprocessing. '''
+    import psMesoWeb
+    from meso_lines import render_json
+    for index, (spec_id, form) in enumerate(forms):
+        info = {'index': index}
+        if spec_id is not None:
+            info['id'] = spec_id
+        if not form.is_valid():
+            info['errors'] = form.errors
+            yield json.dumps(info, sort_keys=True) + '\n'
+            continue
+        data = form.cleaned_data
+        lines, fail = psMesoWeb.mesosticRecords(data['ORACLE'], data['SEED'],
+                                                data['ITERS'],
+                                                int(data['ODDS']),
+                                                data['strippunct'],
+                                                data['BRTYPE'],
+                                                rng=data['RNG'])
+        yield render_json(lines, fail=fail, **info) + '\n'
+
 def aboutmeso(request):
     return render(request, 'aboutmeso.html')
 
@@ -0,0 +1,262 @@
+# coding: utf-8
+
+''' Benchmarks for the P.S.: Meso engines.
+
+Times ps_meso.Mesostic and psMesoWeb.mesosticize over generated oracles
+of 1K to 1M words, with easy, hard and infeasible spines, a range of
+iterations and every sparsity setting. The oracles and every poem come
+from fixed random seeds, so two runs do exactly the same work.
+
+For each case it records the time of each phase - Mesostic.__init__,
+make_poem and format_html; for the legacy engine, the MesoContext, its
+mesostic() and formatHtml() that mesosticize runs - with the lines per
+second and the peak memory allocated (Python 3 only). Loading each
+oracle into the shared cache is timed once per size. Results are
+written as JSON; given a baseline file from an earlier run, cases that
+got slower by more than the tolerance are listed and the exit status is
+1.
+
+usage: python tools/bench.py [-o results.json] [-b baseline.json]
+                             [--sizes 1000,10000] [--quick] '''
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+from bisect import bisect
+from timeit import default_timer
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'psmeso', 'psmeso')]
+
+import ps_meso
+import psMesoWeb
+from meso_cache import POEMS
+from meso_oracle import ORACLES, get_oracle
+
+RNG = 2014
+SIZES = (1000, 10000, 100000, 1000000)
+ITERS = (1, 10, 99)
+SPARSITIES = (2, 4, 8)
+# the generated oracles have no 'q', so a spine with one cannot work;
+# j, k, v, x & z are rare in them, so spines full of those are hard
+SPINES = (('easy', 'Cage'),
+          ('hard', 'Jukebox Vizier'),
+          ('infeasible', 'Queneau'))
+SYLLABLES = ('a e i o u ba be bi bo ca ce co da de di do el en er es fa '
+             'fi ga go ha he hi in is it la le li lo ma me mi mo na ne ni '
+             'no on or pa pe pi po ra re ri ro sa se si so ta te ti to un '
+             'va ve wa we ya jo ka ki ze xo st th ng').split()
+
+
+def make_oracle(size, rng):
+    ''' Returns an oracle of size words drawn from a made-up vocabulary,
+        with word frequencies falling off as in natural text.
+
+        (int, random.Random) -> str '''
+    vocab = sorted(set(''.join(rng.choice(SYLLABLES)
+                               for k in range(rng.randint(1, 4)))
+                       for n in range(4000)))
+    rng.shuffle(vocab)
+    total, cumulative = 0.0, []
+    for rank in range(len(vocab)):
+        total += 1.0 / (rank + 1)
+        cumulative.append(total)
+    words = [vocab[bisect(cumulative, rng.random() * total)]
+             for n in range(size)]
+    # sprinkle in punctuation and section numbers for the tokenizers
+    for n in range(0, size, 17):
+        words[n] += rng.choice(',.;:!?')
+    for n in range(0, size, 997):
+        words[n] = str(n)
+    return ' '.join(words)
+
+
+def measure(phases, fn, *args):
+    ''' Calls fn, adding its run time to phases[fn.__name__]. Returns
+        what fn returns. '''
+    start = default_timer()
+    result = fn(*args)
+    phases[fn.__name__] = phases.get(fn.__name__, 0.0) + \
+        default_timer() - start
+    return result
+
+
+def run_meso(text, seed, iters, sparsity, break_type):
+    ''' Makes one ps_meso mesostic, phase by phase. Returns the phase
+        times, the number of lines and whether it failed. '''
+    phases = {}
+    start = default_timer()
+    poem = ps_meso.Mesostic(text, seed, iters, sparsity, True, break_type,
+                            stream=True, rng=RNG)
+    phases['__init__'] = default_timer() - start
+    measure(phases, poem.make_poem)
+    lines = measure(phases, poem.format_html)[1]
+    return phases, len(lines), poem.fail
+
+
+def run_web(text, seed, iters, sparsity, break_type):
+    ''' Makes one psMesoWeb mesostic, phase by phase, as mesosticize
+        does. Returns the phase times, the number of lines and whether
+        it failed. '''
+    phases = {}
+    start = default_timer()
+    context = psMesoWeb.MesoContext(text, seed, iters, sparsity, True,
+                                    break_type, rng=RNG)
+    phases['__init__'] = default_timer() - start
+    meso, fail = measure(phases, context.mesostic)
+    lines = measure(phases, context.formatHtml, meso, fail)[1]
+    return phases, len(lines), fail
+
+
+ENGINES = (('ps_meso', run_meso), ('psMesoWeb', run_web))
+
+
+def run_case(run, text, seed, iters, sparsity, break_type, repeat):
+    ''' Times a case repeat times, keeping the fastest time of each
+        phase, then measures its peak memory in one more run. '''
+    best = None
+    for n in range(repeat):
+        POEMS.clear()
+        phases, lines, fail = run(text, seed, iters, sparsity, break_type)
+        if best is None:
+            best = phases
+        else:
+            best = dict((k, min(v, best[k])) for k, v in phases.items())
+    peak = None
+    if tracemalloc:
+        tracemalloc.start()
+        run(text, seed, iters, sparsity, break_type)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    total = sum(best.values())
+    return {'phases': best,
+            'seconds': total,
+            'lines': lines,
+            'fail': fail,
+            'lines_per_second': lines / total if total else None,
+            'peak_bytes': peak}
+
+
+def time_load(text):
+    ''' Times tokenizing and compacting an oracle into an empty cache
+        for each engine's tokenizing options. '''
+    times = {}
+    for name, drop_digits in (('ps_meso', False), ('psMesoWeb', True)):
+        ORACLES.clear()
+        start = default_timer()
+        get_oracle(text, True, drop_digits)
+        times[name] = default_timer() - start
+    return times
+
+
+def bench(sizes, iters_list, sparsities, break_types, repeat, log):
+    ''' Runs every case and returns the results. '''
+    results = {'meta': {'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'rng': RNG,
+                        'repeat': repeat},
+               'load': {},
+               'cases': []}
+    for size in sizes:
+        text = make_oracle(size, random.Random(RNG + size))
+        results['load'][str(size)] = time_load(text)
+        # time_load leaves psMesoWeb's tokenizing cached; add ps_meso's
+        get_oracle(text, True, False)
+        for kind, seed in SPINES:
+            for iters in iters_list:
+                for sparsity in sparsities:
+                    for break_type in break_types:
+                        for engine, run in ENGINES:
+                            case = run_case(run, text, seed, iters, sparsity,
+                                            break_type, repeat)
+                            case.update({'engine': engine,
+                                         'words': size,
+                                         'spine': kind,
+                                         'iters': iters,
+                                         'sparsity': sparsity,
+                                         'break_type': break_type})
+                            results['cases'].append(case)
+                            log('%-9s %7d %-10s %2d/%d %-6s %8.2fms'
+                                % (engine, size, kind, iters, sparsity,
+                                   break_type, case['seconds'] * 1000))
+        ORACLES.clear()
+    return results
+
+
+def case_key(case):
+    return (case['engine'], case['words'], case['spine'], case['iters'],
+            case['sparsity'], case['break_type'])
+
+
+def compare(results, baseline, tolerance, floor=0.001):
+    ''' Returns descriptions of the cases that are slower than in the
+        baseline by more than tolerance (a fraction), ignoring those
+        that take less than floor seconds either way. '''
+    old = dict((case_key(case), case) for case in baseline['cases'])
+    slower = []
+    for case in results['cases']:
+        before = old.get(case_key(case))
+        if before is None or max(before['seconds'], case['seconds']) < floor:
+            continue
+        if case['seconds'] > before['seconds'] * (1 + tolerance):
+            slower.append('%s: %.2fms -> %.2fms' %
+                          (' '.join(str(k) for k in case_key(case)),
+                           before['seconds'] * 1000, case['seconds'] * 1000))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-o', '--output', default='bench.json',
+                        help='where to write the results (JSON)')
+    parser.add_argument('-b', '--baseline',
+                        help='results of an earlier run to compare with')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25,
+                        help='slowdown that counts as a regression '
+                             '(default 0.25, i.e. 25%%)')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='oracle sizes in words, comma-separated')
+    parser.add_argument('--iters', default=','.join(map(str, ITERS)),
+                        help='spine iterations, comma-separated')
+    parser.add_argument('--breaks', default='word,random',
+                        help='stanza break types, comma-separated')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per case; the fastest counts')
+    parser.add_argument('--quick', action='store_true',
+                        help='only the oracles of up to 10K words')
+    parser.add_argument('-q', '--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    sizes = [int(n) for n in args.sizes.split(',')]
+    if args.quick:
+        sizes = [n for n in sizes if n <= 10000]
+    log = (lambda line: None) if args.quiet else print
+
+    results = bench(sizes, [int(n) for n in args.iters.split(',')],
+                    SPARSITIES, args.breaks.split(','), args.repeat, log)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print('%d cases written to %s' % (len(results['cases']), args.output))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        for line in slower:
+            print('slower: ' + line)
+        print('%d cases slower than the baseline' % len(slower))
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+# coding: utf-8
+
+''' Builds oracle index files for P.S.: Meso.
+
+Tokenizes each UTF-8 text file through a memory map and writes its index
+(see meso_store) to the output directory, named for the text's
+fingerprint and the tokenizing options, which is where OracleCache
+looks for it when PSMESO_INDEX_DIR names that directory. Spine
+candidates are stored for the letter transitions of any --spine given.
+The web engine drops numbers from its oracles, so build its indexes
+with --drop-digits, and build indexes for engines asked to normalize
+with --normalize.
+
+usage: python tools/build_index.py [-o DIR] [--keep-punct] [--drop-digits]
+                                   [--normalize] [--spine SPINE]... FILE... '''
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from meso_index import spine_key
+from meso_store import index_file
+from meso_tokens import clean_seed
+
+
+def spine_keys(spine, normalize=False):
+    ''' Returns the spine index keys of a spine, with stanza breaks
+        either after words or at random.
+
+        (str, bool) -> list of tuple '''
+    spine = clean_seed(spine, normalize)
+    keys = []
+    for seed in (spine + ' ', spine.replace(' ', '')):
+        for i in range(len(seed)):
+            if seed[i] != ' ' and spine_key(seed, i) not in keys:
+                keys.append(spine_key(seed, i))
+    return keys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('files', nargs='+', metavar='file')
+    parser.add_argument('-o', '--out', default='.',
+                        help='directory to write the index files to')
+    parser.add_argument('--keep-punct', action='store_true',
+                        help="don't strip punctuation from the texts")
+    parser.add_argument('--drop-digits', action='store_true',
+                        help='drop numbers from the texts, as the web '
+                             'engine does')
+    parser.add_argument('--normalize', action='store_true',
+                        help='NFKC-normalize and casefold the texts rather '
+                             'than lowercase them')
+    parser.add_argument('--spine', action='append', default=[],
+                        help='store the candidates for this spine')
+    args = parser.parse_args(argv)
+
+    keys = []
+    for spine in args.spine:
+        keys.extend(key for key in spine_keys(spine, args.normalize)
+                    if key not in keys)
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    for path in args.files:
+        out = index_file(path, args.out, not args.keep_punct,
+                         args.drop_digits, keys, args.normalize)
+        print('%-30s -> %s (%d bytes)' % (path, out, os.path.getsize(out)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
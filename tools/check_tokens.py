@@ -0,0 +1,119 @@
+# coding: utf-8
+
+''' Tokenizer consistency check for P.S.: Meso.
+
+Every way of reading an oracle should give the words meso_tokens.tokenize()
+makes of the whole text: iter_tokens() over text and binary streams read
+a few characters or bytes at a time, and MappedWords over a file read in
+small chunks. Checks them against tokenize() for every tokenizing option,
+on random texts full of awkward characters (multi-byte letters, Windows
+line endings, digits, punctuation, ligatures, full-width and
+case-folding letters) and on any UTF-8 files given. Exits with status 1
+if any reader disagrees.
+
+The random texts have no characters that NFKC turns into more than one
+word, where MappedWords is documented to differ with normalize.
+
+usage: python tools/check_tokens.py [-n TEXTS] [FILE]... '''
+
+from __future__ import print_function
+
+import argparse
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from meso_oracle import MappedWords
+from meso_tokens import iter_tokens, tokenize
+
+PIECES = (u'a', u'B', u'cage', u'1', u'23', u' ', u'  ', u'\n', u'\r\n',
+          u'\t', u'.', u'-', u"'", u'"', u'!', u'—', u'’', u'\xe9',
+          u'\xdc', u'\xdf', u'ﬁ', u'Ｆ', u'　', u'İ',
+          u'ΣΟΣ', u'\U0001f600', u'\xa0')
+OPTIONS = [(strip, drop, normalize) for strip in (False, True)
+           for drop in (False, True) for normalize in (False, True)]
+SIZES = (1, 2, 3, 7, 64)
+
+
+def random_text(rng):
+    ''' Returns a short random text made of PIECES.
+
+        random.Random -> str '''
+    return u''.join(rng.choice(PIECES) for i in range(rng.randint(0, 120)))
+
+
+def readers(text, path, options):
+    ''' Generates the name of each reader and the words it makes of a
+        text, also saved at path, with the given tokenizing options.
+
+        (str, str, tuple) -> generator of (str, list of str) '''
+    for size in SIZES:
+        yield ('iter_tokens(text, %d)' % size,
+               list(iter_tokens(io.StringIO(text), *options, size=size)))
+        yield ('iter_tokens(bytes, %d)' % size,
+               list(iter_tokens(io.BytesIO(text.encode('utf-8')), *options,
+                                size=size)))
+    for chunk in (1, 5, 1 << 20):
+        words = MappedWords(path, *options)
+        words.CHUNK = chunk
+        yield 'MappedWords(%d)' % chunk, list(words)
+        words.close()
+
+
+def check(text, path):
+    ''' Returns a description of each disagreement with tokenize() over
+        a text saved at path.
+
+        (str, str) -> list of str '''
+    with io.open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(text)
+    problems = []
+    for options in OPTIONS:
+        expected = tokenize(text, *options)
+        for name, words in readers(text, path, options):
+            if words != expected:
+                problems.append('%s with options %r: %r, not %r'
+                                % (name, options, words[:8], expected[:8]))
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('files', nargs='*', metavar='file')
+    parser.add_argument('-n', '--texts', type=int, default=500,
+                        help='how many random texts to check')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(0)
+    texts = [(u'random text %d' % i, random_text(rng))
+             for i in range(args.texts)]
+    for path in args.files:
+        with io.open(path, encoding='utf-8', newline='') as f:
+            texts.append((path, f.read()))
+
+    scratch = tempfile.mkdtemp()
+    failed = 0
+    try:
+        path = os.path.join(scratch, 'oracle.txt')
+        for name, text in texts:
+            problems = check(text, path)
+            if problems:
+                failed += 1
+                print('%s (%r):' % (name, text[:60]))
+                for problem in problems[:5]:
+                    print('    ' + problem)
+    finally:
+        shutil.rmtree(scratch)
+    print('%d of %d texts tokenized alike by every reader'
+          % (len(texts) - failed, len(texts)))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+# coding: utf-8
+
+''' Ranks source texts by how well they can carry a mesostic spine.
+
+Loads each text file into a meso_library.Library and lists them best
+first: those that can carry every spine letter, with the number of
+candidates for the scarcest letter and the candidate density, then
+those that cannot, with the letters no word of theirs can carry.
+
+usage: python tools/find_oracles.py [--random] [--keep-punct] SPINE FILE... '''
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from meso_index import describe_key
+from meso_library import Library
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('spine')
+    parser.add_argument('files', nargs='+', metavar='file')
+    parser.add_argument('--random', action='store_true',
+                        help='stanza breaks at random, not after words')
+    parser.add_argument('--keep-punct', action='store_true',
+                        help="don't strip punctuation from the texts")
+    args = parser.parse_args(argv)
+
+    library = Library()
+    for path in args.files:
+        library.add_file(os.path.basename(path), path, not args.keep_punct)
+    ranks = library.rank(args.spine, 'random' if args.random else 'word')
+    for name, blocked, fewest, density in ranks:
+        if blocked:
+            print('%-30s cannot carry %s' %
+                  (name, ', '.join(describe_key(key) for key in blocked)))
+        else:
+            print('%-30s fewest candidates %6d, density %.4f' %
+                  (name, fewest, density))
+    return 0 if ranks and not ranks[0][1] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
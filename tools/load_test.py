@@ -0,0 +1,435 @@
+# coding: utf-8
+
+''' Load test for the P.S.: Meso web app.
+
+Plays a cohort of students hitting the generator at once: each of
+--concurrency virtual users, in a thread of its own, loads the form at
+/psmeso/ and posts a mesostic to it, over and over, until --requests
+poems have been asked for. A poem the view sends to the background job
+queue is polled for until it is done, and counts as one request taking
+that long. The oracles (generated as tools/bench.py makes them, and
+any --oracle files), spines, iterations, sparsities and break types of
+the posts are drawn from a random stream seeded with --seed, so two
+runs ask for the same poems in the same order.
+
+Requests go through Django's test client, or with --wsgi over HTTP to
+a threaded WSGI server started in this process. Unless
+DJANGO_SETTINGS_MODULE is set, Django is configured with just the
+psmeso views. This process is the one worker, so its memory is the
+worker's: resident size before and after the run and at its peak.
+
+Reports p50/p95/p99 latency for the form and the poems, throughput,
+error rate and memory, and writes them as JSON. Given a baseline file
+from an earlier run, a slower p95, lower throughput or higher error
+rate beyond the tolerance is listed and the exit status is 1.
+
+usage: python tools/load_test.py [-c 16] [-n 400] [--wsgi] [-o load.json]
+                                 [-b baseline.json] [--oracle FILE]... '''
+
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import re
+import sys
+import threading
+from timeit import default_timer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'psmeso', 'psmeso')]
+
+from bench import SPINES, make_oracle
+
+RNG = 2014
+SIZES = (1000, 10000, 100000)
+# most assignments ask for a few iterations; some students max it out
+ITERS = (1, 1, 2, 3, 5, 10, 99)
+SPARSITIES = ('2', '4', '8')
+CSRF = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+JOB = re.compile(r'/psmeso/job/([0-9a-f]+)/')
+
+
+def setup_django():
+    ''' Configures Django with the psmeso views, unless a settings
+        module is named in the environment, and sets it up. '''
+    import django
+    from django.conf import settings
+    if not os.environ.get('DJANGO_SETTINGS_MODULE'):
+        settings.configure(
+            DEBUG=False, SECRET_KEY='load-test', ALLOWED_HOSTS=['*'],
+            ROOT_URLCONF=__name__, MIDDLEWARE=[],
+            INSTALLED_APPS=['django.contrib.contenttypes',
+                            'django.contrib.auth'],
+            TEMPLATES=[{'BACKEND':
+                            'django.template.backends.django.DjangoTemplates',
+                        'DIRS': [os.path.join(ROOT, 'psmeso', 'psmeso',
+                                              'templates')]}],
+            LOGGING_CONFIG=None)
+        try:
+            from django.urls import re_path as url
+        except ImportError:
+            from django.conf.urls import url
+        import views
+        globals()['urlpatterns'] = [
+            url(r'^psmeso/$', views.psmeso),
+            url(r'^psmeso/job/(?P<job_id>[0-9a-f]+)/$', views.psmeso_job)]
+    django.setup()
+
+
+def make_plan(n, oracles, seed):
+    ''' Returns the form data of n poem requests drawn from a random
+        stream seeded with seed.
+
+        (int, list of str, int) -> list of dict '''
+    rng = random.Random(seed)
+    plan = []
+    for k in range(n):
+        plan.append({'ORACLE': rng.choice(oracles),
+                     'SEED': rng.choice(SPINES)[1],
+                     'ITERS': rng.choice(ITERS),
+                     'ODDS': rng.choice(SPARSITIES),
+                     'strippunct': 'on',
+                     'BRTYPE': rng.choice(('word', 'random')),
+                     'RNG': rng.randrange(1 << 30)})
+    return plan
+
+
+class TestClientUser(object):
+    ''' A virtual user making requests through Django's test client. '''
+
+    def __init__(self):
+        from django.test import Client
+        self.client = Client()
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, response.content.decode('utf-8')
+
+    def post(self, path, data):
+        response = self.client.post(path, data)
+        return response.status_code, response.content.decode('utf-8')
+
+
+class HTTPUser(object):
+    ''' A virtual user making requests over HTTP, keeping its cookies
+        and sending the CSRF token of the last form it loaded. '''
+
+    def __init__(self, base):
+        try:
+            from http.cookiejar import CookieJar
+            from urllib.request import HTTPCookieProcessor, build_opener
+        except ImportError:
+            from cookielib import CookieJar
+            from urllib2 import HTTPCookieProcessor, build_opener
+        self.base = base
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()))
+        self.token = None
+
+    def open(self, path, body=None):
+        try:
+            from urllib.error import HTTPError
+        except ImportError:
+            from urllib2 import HTTPError
+        try:
+            response = self.opener.open(self.base + path, body)
+            status = response.getcode()
+        except HTTPError as e:
+            response, status = e, e.code
+        text = response.read().decode('utf-8')
+        match = CSRF.search(text)
+        if match:
+            self.token = match.group(1)
+        return status, text
+
+    def get(self, path):
+        return self.open(path)
+
+    def post(self, path, data):
+        try:
+            from urllib.parse import urlencode
+        except ImportError:
+            from urllib import urlencode
+        data = dict(data, csrfmiddlewaretoken=self.token or '')
+        return self.open(path, urlencode(data).encode('utf-8'))
+
+
+def start_server():
+    ''' Starts a threaded WSGI server for the Django app on a free local
+        port. Returns the server and its base URL. '''
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+    try:
+        from socketserver import ThreadingMixIn
+    except ImportError:
+        from SocketServer import ThreadingMixIn
+    from django.core.wsgi import get_wsgi_application
+
+    class Server(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+        request_queue_size = 128
+
+    class Handler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = Server(('127.0.0.1', 0), Handler)
+    server.set_app(get_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%d' % server.server_port
+
+
+def run_user(user, plan, lock, timings, outcomes, errors):
+    ''' Takes poem requests off the plan until it is empty: loads the
+        form, posts the poem and, if it was queued, polls its job.
+        Appends the latency of each to timings, counts how each poem
+        came out in outcomes and appends what went wrong with any
+        request to errors. '''
+    while True:
+        with lock:
+            if not plan:
+                return
+            data = plan.pop()
+        for kind in ('form', 'poem'):
+            start = default_timer()
+            outcome = None
+            try:
+                if kind == 'form':
+                    status, text = user.get('/psmeso/')
+                    problem = None if status == 200 else 'status %d' % status
+                else:
+                    outcome, problem = post_poem(user, data)
+            except Exception as e:
+                problem = 'raised %r' % e
+            elapsed = default_timer() - start
+            with lock:
+                timings[kind].append(elapsed)
+                if outcome:
+                    outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                if problem:
+                    errors.append('%s: %s' % (kind, problem))
+
+
+def post_poem(user, data):
+    ''' Posts a poem, following it to the job queue if it is sent there.
+        Returns how it came out - made, failed (the spine ran out of
+        words), rejected (the form or job found a spine letter no word
+        can carry), queued and made, or busy (the job queue was full) -
+        or None, and what went wrong, or None.
+        '''
+    status, text = user.post('/psmeso/', data)
+    if status == 202:
+        job = JOB.search(text).group(1)
+        while True:
+            status, text = user.get('/psmeso/job/%s/?wait=10' % job)
+            if status != 200:
+                return None, 'job %s: status %d' % (job, status)
+            result = json.loads(text)
+            if result['state'] == 'error':
+                return None, 'job %s: %s' % (job, result['error'])
+            if result['state'] == 'done':
+                return ('queued' if result['mesostic'] else 'rejected'), None
+    if status == 503:
+        return 'busy', None
+    if status != 200:
+        return None, 'status %d' % status
+    if 'Well glonce' in text:
+        return 'made', None
+    if 'Could not complete' in text:
+        return 'failed', None
+    if 'errorlist' in text:
+        return 'rejected', None
+    return None, 'no mesostic or form errors in the page'
+
+
+def percentile(values, p):
+    ''' Returns the p-th percentile of sorted values, by nearest rank. '''
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(p / 100.0 *
+                                                        len(values))) - 1))]
+
+
+def rss():
+    ''' Returns the resident size of this process in bytes, or None
+        where it cannot be read. '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def peak_rss():
+    ''' Returns the peak resident size of this process in bytes, or None
+        where it cannot be read. '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def load_test(plan, concurrency, wsgi):
+    ''' Runs the plan with concurrency virtual users. Returns the
+        results. '''
+    server = None
+    if wsgi:
+        server, base = start_server()
+        make_user = lambda: HTTPUser(base)
+    else:
+        make_user = TestClientUser
+    total = len(plan)
+    plan = list(reversed(plan))
+    lock = threading.Lock()
+    timings = {'form': [], 'poem': []}
+    outcomes = {}
+    errors = []
+    before = rss()
+    start = default_timer()
+    users = [threading.Thread(target=run_user,
+                              args=(make_user(), plan, lock, timings,
+                                    outcomes, errors))
+             for n in range(concurrency)]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = default_timer() - start
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+    results = {'meta': {'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'concurrency': concurrency,
+                        'transport': 'wsgi' if wsgi else 'test client',
+                        'poems': total},
+               'seconds': elapsed,
+               'latency': {},
+               'outcomes': outcomes,
+               'errors': len(errors),
+               'error_rate': float(len(errors)) /
+                             max(1, sum(len(t) for t in timings.values())),
+               'error_samples': errors[:20],
+               'memory': {'rss_before': before, 'rss_after': rss(),
+                          'rss_peak': peak_rss()}}
+    requests = 0
+    for kind, values in timings.items():
+        values.sort()
+        requests += len(values)
+        results['latency'][kind] = dict(
+            [('count', len(values))] +
+            [('p%d' % p, percentile(values, p)) for p in (50, 95, 99)] +
+            [('max', values[-1] if values else None)])
+    results['requests_per_second'] = requests / elapsed if elapsed else None
+    results['poems_per_second'] = total / elapsed if elapsed else None
+    return results
+
+
+def report(results):
+    ''' Prints the results for people. '''
+    print('%d poems, %s, concurrency %d: %.2fs' %
+          (results['meta']['poems'], results['meta']['transport'],
+           results['meta']['concurrency'], results['seconds']))
+    for kind, latency in sorted(results['latency'].items()):
+        if latency['count']:
+            print('  %-5s %5d  p50 %8.1fms  p95 %8.1fms  p99 %8.1fms  '
+                  'max %8.1fms' % (kind, latency['count'],
+                                   latency['p50'] * 1000,
+                                   latency['p95'] * 1000,
+                                   latency['p99'] * 1000,
+                                   latency['max'] * 1000))
+    print('  %.1f requests/s, %.1f poems/s, %d errors (%.2f%%)' %
+          (results['requests_per_second'], results['poems_per_second'],
+           results['errors'], results['error_rate'] * 100))
+    print('  poems: ' + ', '.join('%d %s' % (n, outcome) for outcome, n
+                                  in sorted(results['outcomes'].items())))
+    for error in results['error_samples'][:5]:
+        print('  error: ' + error)
+    memory = dict((k, '%.1fMB' % (v / 1048576.0) if v else '?')
+                  for k, v in results['memory'].items())
+    print('  worker memory: %(rss_before)s before, %(rss_after)s after, '
+          '%(rss_peak)s peak' % memory)
+
+
+def compare(results, baseline, tolerance):
+    ''' Returns descriptions of what got worse than in the baseline by
+        more than tolerance (a fraction). '''
+    worse = []
+    for kind, latency in sorted(results['latency'].items()):
+        before = baseline['latency'].get(kind, {}).get('p95')
+        if before and latency['p95'] > before * (1 + tolerance):
+            worse.append('%s p95: %.1fms -> %.1fms' %
+                         (kind, before * 1000, latency['p95'] * 1000))
+    before = baseline.get('requests_per_second')
+    if before and results['requests_per_second'] < before / (1 + tolerance):
+        worse.append('throughput: %.1f -> %.1f requests/s' %
+                     (before, results['requests_per_second']))
+    if results['error_rate'] > baseline.get('error_rate', 0) + 0.001:
+        worse.append('error rate: %.2f%% -> %.2f%%' %
+                     (baseline.get('error_rate', 0) * 100,
+                      results['error_rate'] * 100))
+    return worse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-c', '--concurrency', type=int, default=16,
+                        help='virtual users making requests at once')
+    parser.add_argument('-n', '--requests', type=int, default=400,
+                        help='poems to ask for in all')
+    parser.add_argument('--wsgi', action='store_true',
+                        help='go over HTTP to a local WSGI server rather '
+                             'than through the test client')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='sizes in words of the generated oracles, '
+                             'comma-separated')
+    parser.add_argument('--oracle', action='append', default=[],
+                        help='a UTF-8 text file to use as an oracle too')
+    parser.add_argument('--seed', type=int, default=RNG,
+                        help='seed of the random stream the requests are '
+                             'drawn from')
+    parser.add_argument('-o', '--output', default='load.json',
+                        help='where to write the results (JSON)')
+    parser.add_argument('-b', '--baseline',
+                        help='results of an earlier run to compare with')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25,
+                        help='change that counts as a regression '
+                             '(default 0.25, i.e. 25%%)')
+    args = parser.parse_args(argv)
+
+    setup_django()
+    oracles = [make_oracle(int(size), random.Random(args.seed + int(size)))
+               for size in args.sizes.split(',') if size]
+    for path in args.oracle:
+        with io.open(path, encoding='utf-8') as f:
+            oracles.append(f.read())
+    plan = make_plan(args.requests, oracles, args.seed)
+
+    results = load_test(plan, args.concurrency, args.wsgi)
+    report(results)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print('results written to %s' % args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            worse = compare(results, json.load(f), args.tolerance)
+        for line in worse:
+            print('worse: ' + line)
+        return 1 if worse else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
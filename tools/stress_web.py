@@ -0,0 +1,101 @@
+# coding: utf-8
+
+''' Concurrency stress check for the P.S.: Meso engines.
+
+Makes many mesostics at once from a pool of threads, as a threaded WSGI
+worker would, with both psMesoWeb.mesosticize and ps_meso.Mesostic.
+Every job has an oracle whose words all end in the job's own tag and a
+spine of its own, so a poem that picked up another request's state
+shows words with a foreign tag or a spine that spells something else.
+Exits with status 1 if any poem does.
+
+usage: python tools/stress_web.py [threads] [jobs per thread] '''
+
+from __future__ import print_function
+
+import os
+import random
+import re
+import sys
+import threading
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'psmeso', 'psmeso')]
+
+import ps_meso
+import psMesoWeb
+
+WORDS = ('walt whitman i celebrate myself and sing myself and what i assume '
+         'you shall assume for every atom belonging to me as good belongs '
+         'to you loafe invite my soul lean at ease observing a spear of '
+         'summer grass tongue every this soil air born here from parents '
+         'the same their same now thirty seven years old perfect health '
+         'begin hoping not cease till death creeds schools abeyance').split()
+SPINES = ['Cage', 'Howl', 'Whitman', 'Ginsberg', 'Stein', 'Dickinson',
+          'Pound', 'Moore', 'Bishop', 'Oppen', 'Niedecker', 'Olson']
+BOLD = re.compile(r'<b>(.)</b>')
+
+
+def oracle(tag, rng):
+    ''' Returns a shuffled oracle whose every word ends in tag. '''
+    words = [word + tag for word in WORDS * 40]
+    rng.shuffle(words)
+    return ' '.join(words)
+
+
+def check(lines, tag, spine):
+    ''' Returns a description of what is wrong with a formatted poem, or
+        None if it is all its own. '''
+    letters = ''.join(BOLD.findall(''.join(lines))).lower().replace(' ', '')
+    if not letters or not (spine.lower() * 10).startswith(letters):
+        return 'spine %r is not %r' % (letters, spine)
+    for line in lines:
+        for word in BOLD.sub(lambda m: m.group(1), line).split():
+            if not word.lower().endswith(tag):
+                return 'word %r is not from oracle %s' % (word, tag)
+    return None
+
+
+def worker(n, jobs, errors):
+    ''' Makes jobs mesostics in turn, alternating engines. '''
+    rng = random.Random(n)
+    for j in range(jobs):
+        tag = '%02d%d' % (n, j % 3)
+        spine = SPINES[(n + j) % len(SPINES)]
+        text = oracle(tag, rng)
+        iters = rng.randint(1, 10)
+        odds = rng.choice((2, 4, 8))
+        brtype = rng.choice(('word', 'random'))
+        try:
+            if j % 2:
+                lines = psMesoWeb.mesosticize(text, spine, iters, odds, True,
+                                              brtype)[1]
+            else:
+                lines = ps_meso.Mesostic(text, spine, iters, odds, True,
+                                         brtype).format_html()[1]
+            problem = check(lines, tag, spine)
+        except Exception as e:
+            problem = 'raised %r' % e
+        if problem:
+            errors.append('thread %d job %d: %s' % (n, j, problem))
+
+
+def main(threads=16, jobs=50):
+    # switch threads as often as possible to shake out shared state
+    if hasattr(sys, 'setswitchinterval'):
+        sys.setswitchinterval(1e-6)
+    errors = []
+    pool = [threading.Thread(target=worker, args=(n, jobs, errors))
+            for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    for error in errors[:20]:
+        print(error)
+    print('%d threads x %d jobs: %d interfered' % (threads, jobs, len(errors)))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:3]]))